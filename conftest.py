@@ -0,0 +1,8 @@
+"""Pytest configuration"""
+
+import sys
+
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('pipcompilemulti/aiobackend.py')
@@ -2,64 +2,400 @@
 """High level actions to be called from CLI"""
 
 import os
+import sys
+import time
 import logging
 import itertools
+import collections
 
-from .options import OPTIONS, DEFAULT_HEADER
-from .discover import discover
+import six
+
+from .options import Settings, DEFAULT_HEADER
+from .cache import ResolutionCache
+from .backends import BACKENDS
+from .discover import discover_environments
 from .environment import Environment
-from .verify import generate_hash_comment
+from .dependency import Dependency
+from .executor import iter_completed
+from .files import read_bytes
+from .graph import EnvironmentGraph
+from .interpreters import target_version
+from .journal import Journal
+from .pins import PinTable
+from .preflight import check_constraints, normalize
+from .verify import (
+    generate_hash_comment,
+    generate_fingerprint_comment,
+    parse_fingerprint_comment,
+)
 
 
 logger = logging.getLogger("pip-compile-multi")
 
+# Result of recompile: names of environments in order of references,
+# paths of changed lockfiles, and dict of packages locked in each environment.
+RecompileResult = collections.namedtuple(
+    'RecompileResult', 'environments changed packages',
+)
+
 
-def recompile():
+def recompile(pins=None, modified=None, env_confs=None, settings=None):
     """
     Compile requirements files for all environments.
+
+    pins - PinTable with packages locked by previous runs,
+           it's updated with packages of all environments.
+    modified - set of names of environments with modified input files.
+           If given, only these environments and environments
+           referencing them are recompiled.
+    env_confs - environments returned by discover_environments(),
+           discovered if not given.
+    settings - Settings of the run, global OPTIONS if not given.
+
+    Return RecompileResult.
     """
-    pinned_packages = {}
-    env_confs = discover(
-        os.path.join(
-            OPTIONS['base_dir'],
-            '*.' + OPTIONS['in_ext'],
-        ),
-    )
-    if OPTIONS['header_file']:
-        with open(OPTIONS['header_file']) as fp:
+    if settings is None:
+        settings = Settings.from_options()
+    if pins is None:
+        pins = PinTable()
+    if env_confs is None:
+        env_confs = discover_environments(settings)
+    graph = EnvironmentGraph(env_confs)
+    env_confs = included_environments(env_confs, graph, settings)
+    if settings['preflight']:
+        check_constraints(
+            graph,
+            [conf['name'] for conf in env_confs],
+            use_lockfiles=not settings['upgrade'],
+            upgrading=settings['upgrade_packages'],
+            settings=settings,
+        )
+    if settings['header_file']:
+        with open(settings['header_file']) as fp:
             base_header_text = fp.read()
     else:
         base_header_text = DEFAULT_HEADER
-    hashed_by_reference = set()
-    for name in OPTIONS['add_hashes']:
-        hashed_by_reference.update(
-            reference_cluster(env_confs, name)
+    cache = None
+    if settings['cache_dir']:
+        cache = ResolutionCache(
+            settings['cache_dir'],
+            max_size=settings['cache_size'] * 1024 * 1024,
         )
-    included_and_refs = set(OPTIONS['include_names'])
+    backend = BACKENDS[settings['backend']]()
+    try:
+        envs = create_environments(env_confs, graph, cache, backend,
+                                   settings)
+        fingerprints = environment_fingerprints(env_confs, envs, graph,
+                                                base_header_text)
+        journal = Journal(Journal.path(settings))
+        skipped = skipped_environments(envs, graph, fingerprints, modified,
+                                       journal, settings)
+        changed = lock_environments(
+            env_confs, envs, graph, skipped, pins,
+            fingerprints, base_header_text, journal, settings,
+        )
+    finally:
+        backend.close()
+        if cache is not None:
+            cache.log_stats()
+            cache.evict()
+    journal.remove()
+    return RecompileResult(
+        environments=[conf['name'] for conf in env_confs],
+        changed=changed,
+        packages=dict(
+            (conf['name'], dict(pins.packages[conf['name']]))
+            for conf in env_confs
+        ),
+    )
+
+
+def included_environments(env_confs, graph, settings):
+    """
+    Return environments included with include_names option
+    and environments referenced by them, or all environments
+    if the option is not set.
+    """
+    included_and_refs = set(settings['include_names'])
     for name in set(included_and_refs):
-        included_and_refs.update(
-            recursive_refs(env_confs, name)
+        included_and_refs.update(graph.ancestors(name))
+    if not included_and_refs:
+        return env_confs
+    return [
+        conf for conf in env_confs
+        if conf['name'] in included_and_refs
+    ]
+
+
+def create_environments(env_confs, graph, cache, backend, settings):
+    """
+    Return dict of environment names to Environment objects.
+    With resolution cache, lockfiles are read before any job starts,
+    as their contents are part of cache keys of referencing environments.
+    """
+    hashed_by_reference = set()
+    for name in settings['add_hashes']:
+        hashed_by_reference.update(graph.cluster(name))
+    envs = dict(
+        (conf['name'], Environment(
+            name=conf['name'],
+            forbid_post=conf['name'] in settings['forbid_post'],
+            add_hashes=conf['name'] in hashed_by_reference,
+            cache=cache,
+            backend=backend,
+            ancestors=graph.ancestors(conf['name']),
+            settings=settings,
+        ))
+        for conf in env_confs
+    )
+    if cache is not None:
+        lockfiles = dict(
+            (name, read_bytes(env.outfile)) for name, env in envs.items()
         )
+        for env in envs.values():
+            env.lockfiles = lockfiles
+    return envs
+
+
+def environment_fingerprints(env_confs, envs, graph, header_text):
+    """
+    Return dict of environment names to fingerprint comments,
+    covering their input files, settings and fingerprints of references.
+    """
+    fingerprints = {}
     for conf in env_confs:
-        if included_and_refs:
-            if conf['name'] not in included_and_refs:
-                # Skip envs that are not included or referenced by included:
-                continue
-        rrefs = recursive_refs(env_confs, conf['name'])
-        add_hashes = conf['name'] in hashed_by_reference
-        env = Environment(
-            name=conf['name'],
-            ignore=merged_packages(pinned_packages, rrefs),
-            forbid_post=conf['name'] in OPTIONS['forbid_post'],
-            add_hashes=add_hashes,
+        env = envs[conf['name']]
+        fingerprints[conf['name']] = generate_fingerprint_comment(
+            env.infile,
+            fingerprint_components(env, header_text) + [
+                fingerprints[ref]
+                for ref in sorted(graph.ancestors(conf['name']))
+            ],
         )
-        logger.info("Locking %s to %s. References: %r",
-                    env.infile, env.outfile, sorted(rrefs))
-        env.create_lockfile()
-        header_text = generate_hash_comment(env.infile) + base_header_text
-        env.replace_header(header_text)
-        env.add_references(conf['refs'])
-        pinned_packages[conf['name']] = env.packages
+    return fingerprints
+
+
+def skipped_environments(envs, graph, fingerprints, modified, journal,
+                         settings):
+    """
+    Return set of names of environments, that don't need recompiling:
+    lockfiles up to date in incremental mode, environments not affected
+    by modified ones or by upgraded packages, and environments completed
+    by interrupted run in resume mode.
+    Set rebuild flag of environments, which pip-tools caches
+    can't be reused.
+    """
+    for env in envs.values():
+        # pip-tools dependency cache is keyed by package version,
+        # so it's safe to reuse unless upgrading:
+        env.rebuild = settings['rebuild'] == 'always' or settings['upgrade']
+    up_to_date = set(
+        name
+        for name, env in envs.items()
+        if os.path.exists(env.outfile) and
+        parse_fingerprint_comment(env.outfile) == fingerprints[name]
+    )
+    if not settings['incremental'] or settings['upgrade']:
+        up_to_date = set()
+    if modified is None and settings['upgrade_packages']:
+        modified = environments_pinning(envs.values(),
+                                        settings['upgrade_packages'])
+        logger.info("Upgrading %s in %s",
+                    ', '.join(settings['upgrade_packages']),
+                    ', '.join(sorted(modified)) or '-')
+    if modified is not None:
+        affected = set()
+        for name in modified:
+            if name in graph:
+                affected.add(name)
+                affected.update(graph.descendants(name))
+        up_to_date = set(envs) - affected
+    if settings['resume']:
+        journal.load()
+        up_to_date.update(
+            name
+            for name, env in envs.items()
+            if os.path.exists(env.outfile) and
+            journal.is_completed(name, fingerprints[name], env.outfile)
+        )
+    return up_to_date
+
+
+def lock_environments(env_confs, envs, graph, skipped, pins,
+                      fingerprints, base_header_text, journal, settings):
+    """
+    Resolve environments, that are not skipped, in parallel jobs,
+    and write their lockfiles in topological order.
+    Record progress of each compiled environment in journal.
+    Return list of paths of changed lockfiles.
+    Failures cancel referencing environments, but not other branches,
+    and the first of them is re-raised when all jobs are done.
+    """
+    failed = collections.OrderedDict()
+
+    def resolve(conf):
+        """Run pip-compile for single environment"""
+        if conf['name'] in skipped:
+            return
+        env = envs[conf['name']]
+        if env.cancelled:
+            # Cancelled while waiting for a free job
+            return
+        if settings['constraints']:
+            # References are already locked, as jobs wait for them:
+            env.constraints = pins.frozen(graph.ancestors(conf['name']),
+                                          exact=True)
+        logger.debug("Resolving %s to %s.", env.infile, env.outfile)
+        resolve_with_retries(env)
+
+    changed = []
+    completed = set()
+    for conf, _ in iter_completed(
+            resolve, env_confs,
+            jobs=settings['jobs'],
+            wait_refs=settings['constraints'],
+            failed=failed,
+            on_cancel=lambda conf: cancel(envs[conf['name']])):
+        # Fix-up runs in topological order as resolutions complete:
+        env = envs[conf['name']]
+        try:
+            if fix_up(env, conf['refs'], graph, env.name in skipped, pins,
+                      header_text(fingerprints[env.name], base_header_text,
+                                  settings)):
+                changed.append(env.outfile)
+        except Exception:  # pylint: disable=broad-except
+            failed[env.name] = sys.exc_info()
+        else:
+            completed.add(env.name)
+        if env.name not in skipped:
+            journal.record(
+                env.name, fingerprints[env.name],
+                Journal.COMPLETED if env.name in completed else Journal.FAILED,
+                env.outfile,
+            )
+    logger.info("%d of %d lockfiles changed: %s",
+                len(changed), len(env_confs), ', '.join(changed) or '-')
+    if failed:
+        for conf in env_confs:
+            if conf['name'] not in completed:
+                envs[conf['name']].remove_resolved_file()
+        report_failures(env_confs, completed, failed)
+    return changed
+
+
+def report_failures(env_confs, completed, failed):
+    """
+    Log failed and cancelled environments,
+    and re-raise exception of the first failed one.
+    """
+    cancelled = [
+        conf['name'] for conf in env_confs
+        if conf['name'] not in completed and conf['name'] not in failed
+    ]
+    logger.error("Failed environments: %s. Cancelled environments: %s",
+                 ', '.join(failed), ', '.join(cancelled) or '-')
+    six.reraise(*next(iter(failed.values())))
+
+
+def header_text(fingerprint, base_header_text, settings):
+    """
+    Return header of lockfile, that starts with fingerprint comment
+    in incremental mode, which compares it with fingerprint of inputs.
+    """
+    if settings['incremental']:
+        return fingerprint + base_header_text
+    return base_header_text
+
+
+def fix_up(env, refs, graph, skipped, pins, header_text):
+    """
+    Write lockfile of resolved environment with pins of references
+    removed, or read packages from lockfile of skipped environment.
+    Add environment packages to pins.
+    Return True if lockfile changed.
+    """
+    ancestors = graph.ancestors(env.name)
+    if skipped:
+        logger.info("Skipping %s: %s is up to date.",
+                    env.infile, env.outfile)
+        if env.name not in pins.packages:
+            pins.add(env.name, env.packages, env.read_packages())
+        return False
+    logger.info("Locking %s to %s. References: %r",
+                env.infile, env.outfile, sorted(ancestors))
+    env.ignore = pins.merged(ancestors)
+    changed = env.write_lockfile(
+        generate_hash_comment(env.infile) + header_text,
+        refs,
+    )
+    pins.add(env.name, env.packages)
+    return changed
+
+
+def environments_pinning(envs, packages):
+    """
+    Return set of names of environments, which lockfiles pin
+    any of given packages, or don't exist yet.
+    """
+    keys = set(normalize(package) for package in packages)
+    names = set()
+    for env in envs:
+        if not os.path.exists(env.outfile):
+            names.add(env.name)
+            continue
+        with open(env.outfile, 'rt') as fp:
+            for dep in Dependency.parse_text(fp.read()):
+                if dep.valid and normalize(dep.package) in keys:
+                    names.add(env.name)
+                    break
+    return names
+
+
+def resolve_with_retries(env):
+    """
+    Resolve environment retrying failed pip-compile runs
+    as many times as retries option says, with exponentially growing delay.
+    Cancelled environment is not retried.
+    """
+    settings = env.settings
+    for attempt in itertools.count():
+        try:
+            env.resolve()
+            return
+        except RuntimeError as exc:
+            if attempt >= settings['retries'] or env.cancelled:
+                raise
+            delay = settings['retry_delay'] * 2 ** attempt
+            logger.warning("%s. Retrying in %s seconds.", exc, delay)
+            time.sleep(delay)
+
+
+def cancel(env):
+    """Stop resolving environment killing its running pip-compile"""
+    env.cancelled = True
+    env.backend.kill(env)
+
+
+def fingerprint_components(env, header_text):
+    """
+    Return list of strings, that affect environment lockfile
+    in addition to its input file and references.
+    Version of interpreter is included only when it's set explicitly,
+    so that lockfiles don't change with Python running the tool.
+    """
+    components = [
+        header_text,
+        env.settings['out_ext'],
+        ','.join(sorted(env.settings['compatible_patterns'])),
+        'forbid_post={0}'.format(env.forbid_post),
+        'add_hashes={0}'.format(env.add_hashes),
+    ]
+    python_executable = env.settings['python_executable']
+    if python_executable:
+        components.append(
+            'python={0}'.format(target_version(python_executable)),
+        )
+    return components
 
 
 def merged_packages(env_packages, names):
@@ -76,29 +412,10 @@ def merged_packages(env_packages, names):
     ... ).items())
     [('x', 1), ('y', 2), ('z', 3)]
     """
-    combined_packages = sorted(itertools.chain.from_iterable(
-        env_packages[name].items()
-        for name in names
-    ))
-    result = {}
-    errors = set()
-    for name, version in combined_packages:
-        if name in result:
-            if result[name] != version:
-                errors.add((name, version, result[name]))
-        else:
-            result[name] = version
-    if errors:
-        for error in sorted(errors):
-            logger.error(
-                "Package %s was resolved to different "
-                "versions in different environments: %s and %s",
-                error[0], error[1], error[2],
-            )
-        raise RuntimeError(
-            "Please add constraints for the package version listed above"
-        )
-    return result
+    pins = PinTable()
+    for name in names:
+        pins.add(name, env_packages[name])
+    return dict(pins.merged(names))
 
 
 def recursive_refs(envs, name):
@@ -113,19 +430,7 @@ def recursive_refs(envs, name):
     >>> local_refs == ['base', 'test']
     True
     """
-    refs_by_name = {
-        env['name']: set(env['refs'])
-        for env in envs
-    }
-    refs = refs_by_name[name]
-    if refs:
-        indirect_refs = set(itertools.chain.from_iterable([
-            recursive_refs(envs, ref)
-            for ref in refs
-        ]))
-    else:
-        indirect_refs = set()
-    return set.union(refs, indirect_refs)
+    return set(EnvironmentGraph(envs).ancestors(name))
 
 
 def reference_cluster(envs, name):
@@ -141,23 +446,4 @@ def reference_cluster(envs, name):
     >>> cluster == ['base', 'local', 'test']
     True
     """
-    edges = [
-        set([env['name'], ref])
-        for env in envs
-        for ref in env['refs']
-    ]
-    prev, cluster = set(), set([name])
-    while prev != cluster:
-        # While cluster grows
-        prev = set(cluster)
-        to_visit = []
-        for edge in edges:
-            if cluster & edge:
-                # Add adjacent nodes:
-                cluster |= edge
-            else:
-                # Leave only edges that are out
-                # of cluster for the next round:
-                to_visit.append(edge)
-        edges = to_visit
-    return cluster
+    return set(EnvironmentGraph(envs).cluster(name))
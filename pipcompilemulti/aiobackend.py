@@ -0,0 +1,181 @@
+"""Backend running pip-compile subprocesses from asyncio event loop"""
+
+import sys
+import logging
+import threading
+import functools
+import collections
+
+# Module is imported only on Python 3.5+,
+# it's written without async syntax to stay parseable by Python 2:
+import asyncio  # pylint: disable=import-error
+from concurrent import futures  # pylint: disable=import-error
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+class AsyncioBackend(object):
+    """
+    Run pip-compile subprocesses from one event loop in background thread.
+
+    Output of each subprocess is logged line by line as it's produced,
+    and only last lines are kept in memory for error report.
+    Compilations requested from different threads run concurrently.
+    Call close() to stop the loop thread when backend is not needed.
+    Requires Python 3.5+.
+    On Python older than 3.8 backend must be created in the main thread,
+    where asyncio child watcher can be attached to the loop.
+    """
+
+    OUTPUT_LINES = 200
+    LINE_LIMIT = 1024 * 1024
+
+    def __init__(self):
+        if sys.platform == 'win32':
+            self.loop = asyncio.ProactorEventLoop()
+        else:
+            if (sys.version_info < (3, 8) and
+                    threading.current_thread() is not threading.main_thread()):
+                raise RuntimeError(
+                    "asyncio backend can't be created outside of the main "
+                    "thread on Python {0}.{1}, use subprocess backend".format(
+                        *sys.version_info[:2]
+                    )
+                )
+            self.loop = asyncio.new_event_loop()
+            if sys.version_info < (3, 8):
+                # Child watcher must be attached from the main thread:
+                asyncio.get_child_watcher().attach_loop(self.loop)
+        self.protocols = {}
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """Stop event loop and wait for its thread to finish"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def compile(self, env):
+        """Run pip-compile for environment, raise RuntimeError on failure"""
+        timeout = env.settings['timeout']
+        result = futures.Future()
+        self.loop.call_soon_threadsafe(
+            self.start, env.name, env.pin_command, timeout, result,
+        )
+        exit_code, output, killed = result.result()
+        if killed == OutputProtocol.CANCELLED:
+            raise RuntimeError(
+                "Cancelled pip-compile of {0}".format(env.infile)
+            )
+        if exit_code != 0:
+            logger.critical("ERROR executing %s", ' '.join(env.pin_command))
+            logger.critical("Exit code: %s", exit_code)
+            logger.critical('\n'.join(output))
+            if killed == OutputProtocol.TIMED_OUT:
+                raise RuntimeError(
+                    "Timed out after {0} seconds pip-compiling {1}".format(
+                        timeout, env.infile,
+                    )
+                )
+            raise RuntimeError("Failed to pip-compile {0}".format(env.infile))
+
+    def kill(self, env):
+        """Kill running pip-compile of environment, if any"""
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.cancel, env.name)
+
+    def cancel(self, name):
+        """Kill command started for name from event loop thread"""
+        protocol = self.protocols.get(name)
+        if protocol is not None:
+            protocol.kill(OutputProtocol.CANCELLED)
+
+    def start(self, name, command, timeout, result):
+        """
+        Start command from event loop thread streaming its output to logger.
+        Kill it if it runs longer than timeout seconds (0 for no timeout).
+        Result future is set to tuple of exit code, list of last output lines,
+        and reason command was killed for, if it was.
+        """
+        protocol = OutputProtocol(name, timeout, result, self.OUTPUT_LINES)
+        self.protocols[name] = protocol
+        # Result is always set from event loop thread:
+        result.add_done_callback(lambda _: self.protocols.pop(name, None))
+        started = asyncio.ensure_future(
+            self.loop.subprocess_exec(lambda: protocol, *command, stdin=None),
+            loop=self.loop,
+        )
+        started.add_done_callback(functools.partial(_check_started, result))
+
+
+class OutputProtocol(asyncio.SubprocessProtocol):
+    """
+    Log subprocess output lines as they're received
+    keeping last lines, and set result when process exits
+    and its output is closed.
+    """
+
+    TIMED_OUT = 'timed out'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, name, timeout, result, max_lines):
+        self.name = name
+        self.timeout = timeout
+        self.result = result
+        self.output = collections.deque(maxlen=max_lines)
+        self.buffers = {}
+        self.transport = None
+        self.killed = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.killed:
+            transport.kill()
+        elif self.timeout:
+            asyncio.get_event_loop().call_later(self.timeout, self.kill)
+
+    def pipe_data_received(self, fd, data):
+        lines = (self.buffers.pop(fd, b'') + data).split(b'\n')
+        for line in lines[:-1]:
+            self.append(line)
+        if len(lines[-1]) > AsyncioBackend.LINE_LIMIT:
+            self.append(lines[-1])
+        elif lines[-1]:
+            self.buffers[fd] = lines[-1]
+
+    def pipe_connection_lost(self, fd, exc):
+        if fd in self.buffers:
+            self.append(self.buffers.pop(fd))
+
+    def connection_lost(self, exc):
+        if not self.result.done():
+            self.result.set_result((
+                self.transport.get_returncode(),
+                list(self.output),
+                self.killed,
+            ))
+        self.transport.close()
+
+    def kill(self, reason=TIMED_OUT):
+        """Kill process, that is still running, for given reason"""
+        if not self.result.done():
+            self.killed = reason
+            if self.transport is not None:
+                self.transport.kill()
+
+    def append(self, line):
+        """Log output line and keep it for error report"""
+        line = line.decode('utf-8', 'replace').rstrip()
+        self.output.append(line)
+        logger.debug("%s: %s", self.name, line)
+
+
+def _check_started(result, started):
+    """Pass exception of failed subprocess start to result future"""
+    if started.exception() is not None and not result.done():
+        result.set_exception(started.exception())
@@ -0,0 +1,85 @@
+"""Library interface running with explicit settings instead of OPTIONS"""
+
+import functools
+
+from .options import Settings
+
+
+__all__ = (
+    'Settings',
+    'compile_environments',
+    'compile_environments_async',
+    'verify',
+    'verify_async',
+)
+
+
+def compile_environments(settings=None, env_confs=None):
+    """
+    Compile requirements files for all environments
+    and return RecompileResult with names of environments,
+    paths of changed lockfiles and locked packages.
+    Raise RuntimeError on failure.
+
+    settings - Settings of the run, default settings if not given.
+    env_confs - environments returned by discover_environments(),
+                discovered if not given.
+
+    Global OPTIONS are not used, so runs with different settings
+    can execute concurrently in one process,
+    as long as they don't share base directory.
+    inprocess backend is refused, as it replaces process-wide
+    sys.stdout and sys.stderr, and patches pip-tools module.
+    """
+    from .actions import recompile
+    if settings is None:
+        settings = Settings()
+    if settings['backend'] == 'inprocess':
+        raise RuntimeError(
+            "inprocess backend replaces sys.stdout and sys.stderr "
+            "of the whole process and can't be used by library, "
+            "please choose subprocess or asyncio backend"
+        )
+    return recompile(env_confs=env_confs, settings=settings)
+
+
+def verify(settings=None, env_confs=None):
+    """
+    Verify hash comments of all environments
+    and return list of VerifyResult.
+    Arguments are the same as for compile_environments.
+    """
+    from .verify import check_environments
+    if settings is None:
+        settings = Settings()
+    return check_environments(env_confs=env_confs, settings=settings)
+
+
+def compile_environments_async(settings=None, env_confs=None, executor=None):
+    """
+    Return asyncio future with result of compile_environments
+    running in executor, default executor of event loop if not given.
+    On Python 3.7+ it must be called while event loop is running.
+    Requires Python 3.4+.
+    """
+    return _run_in_executor(executor, compile_environments,
+                            settings, env_confs)
+
+
+def verify_async(settings=None, env_confs=None, executor=None):
+    """
+    Return asyncio future with result of verify running in executor.
+    Requires Python 3.4+.
+    """
+    return _run_in_executor(executor, verify, settings, env_confs)
+
+
+def _run_in_executor(executor, func, *args):
+    """Schedule func(*args) in executor of running event loop"""
+    import asyncio
+    try:
+        loop = asyncio.get_running_loop()
+    except AttributeError:
+        # Python < 3.7:
+        loop = asyncio.get_event_loop()
+    return loop.run_in_executor(executor, functools.partial(func, *args))
@@ -0,0 +1,214 @@
+"""Backends running pip-compile"""
+
+import sys
+import logging
+import threading
+import subprocess
+
+import six
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+class SubprocessBackend(object):
+    """Run pip-compile console script in a subprocess for each environment"""
+
+    def __init__(self):
+        self._timers = {}
+        self._killed = set()
+        self._lock = threading.Lock()
+
+    def compile(self, env):
+        """Run pip-compile for environment, raise RuntimeError on failure"""
+        process = subprocess.Popen(
+            env.pin_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        timer = Timeout(env.settings['timeout'], process.kill)
+        with self._lock:
+            self._timers[env.name] = timer
+            self._killed.discard(env.name)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            timer.cancel()
+            with self._lock:
+                del self._timers[env.name]
+        if env.name in self._killed:
+            raise RuntimeError(
+                "Cancelled pip-compile of {0}".format(env.infile)
+            )
+        if process.returncode != 0:
+            logger.critical("ERROR executing %s", ' '.join(env.pin_command))
+            logger.critical("Exit code: %s", process.returncode)
+            logger.critical(stdout.decode('utf-8'))
+            logger.critical(stderr.decode('utf-8'))
+            timer.check(env)
+            raise RuntimeError("Failed to pip-compile {0}".format(env.infile))
+
+    def kill(self, env):
+        """Kill running pip-compile of environment, if any"""
+        with self._lock:
+            timer = self._timers.get(env.name)
+            if timer is None:
+                return
+            self._killed.add(env.name)
+        try:
+            timer.kill()
+        except OSError:
+            # Process has already exited
+            pass
+
+    def close(self):
+        """Nothing to release, subprocesses are waited in compile"""
+
+
+class Timeout(object):
+    """Call kill function if it's not cancelled in given number of seconds"""
+
+    def __init__(self, seconds, kill):
+        self.seconds = seconds
+        self.kill = kill
+        self.expired = False
+        self.timer = None
+        if seconds:
+            self.timer = threading.Timer(seconds, self._expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _expire(self):
+        """Mark timeout as expired and call kill"""
+        self.expired = True
+        self.kill()
+
+    def cancel(self):
+        """Stop timer"""
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def check(self, env):
+        """Raise RuntimeError if timeout expired"""
+        if self.expired:
+            raise RuntimeError("Timed out after {0} seconds pip-compiling {1}"
+                               .format(self.seconds, env.infile))
+
+
+class InProcessBackend(object):
+    """
+    Run pip-compile command in current interpreter.
+
+    Saves interpreter startup and pip-tools import for every environment,
+    and shares package repository (and its metadata cache)
+    between all environments compiled by the same backend instance.
+    pip-tools is not thread-safe, so compilations are serialized.
+    """
+
+    _lock = threading.Lock()
+    INDEX_OPTIONS = ('--pre',)
+    INDEX_OPTIONS_WITH_VALUE = (
+        '-i', '--index-url', '--extra-index-url', '-f', '--find-links',
+        '--trusted-host', '--cert', '--client-cert',
+    )
+
+    def __init__(self):
+        self._repositories = {}
+
+    def compile(self, env):
+        """Run pip-compile for environment, raise RuntimeError on failure"""
+        python_executable = env.settings['python_executable']
+        if python_executable:
+            raise RuntimeError(
+                "Can't pip-compile {0} with {1} in current process".format(
+                    env.infile, python_executable,
+                )
+            )
+        # pylint: disable=import-error,redefined-builtin
+        from piptools.scripts import compile as compile_script
+        args = env.pin_command[1:]
+        with self._lock:
+            original_factory = compile_script.PyPIRepository
+            compile_script.PyPIRepository = self._shared(
+                original_factory, self.repository_key(args),
+            )
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = output = six.StringIO()
+            # pip reconfigures logging and disables existing loggers:
+            root_handlers = logging.root.handlers[:]
+            root_level = logging.root.level
+            try:
+                compile_script.cli.main(
+                    args=args,
+                    prog_name='pip-compile',
+                    standalone_mode=False,
+                )
+                exit_code = 0
+            except SystemExit as exc:
+                exit_code = exc.code
+            except Exception as exc:  # pylint: disable=broad-except
+                output.write(u'{0!r}\n'.format(exc))
+                exit_code = 1
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+                compile_script.PyPIRepository = original_factory
+                logging.root.handlers[:] = root_handlers
+                logging.root.setLevel(root_level)
+                logger.disabled = False
+        if exit_code:
+            logger.critical("ERROR executing %s", ' '.join(env.pin_command))
+            logger.critical("Exit code: %s", exit_code)
+            logger.critical(output.getvalue())
+            raise RuntimeError("Failed to pip-compile {0}".format(env.infile))
+
+    def kill(self, env):
+        """
+        Do nothing, pip-compile running in current process
+        can't be interrupted.
+        """
+
+    def close(self):
+        """Release shared package repositories"""
+        self._repositories.clear()
+
+    @classmethod
+    def repository_key(cls, args):
+        """
+        Return tuple of pip-compile arguments configuring package index.
+
+        pip-compile builds fresh pip options and session objects
+        on every run, so they can't be used to tell repositories apart.
+        """
+        key = []
+        args = iter(args)
+        for arg in args:
+            option = arg.split('=', 1)[0]
+            if option in cls.INDEX_OPTIONS:
+                key.append(arg)
+            elif option in cls.INDEX_OPTIONS_WITH_VALUE:
+                if option == arg:
+                    arg = '{0}={1}'.format(option, next(args, ''))
+                key.append(arg)
+        return tuple(key)
+
+    def _shared(self, factory, key):
+        """Wrap repository factory to return one instance per index key"""
+        def shared_factory(*args, **kwargs):
+            """Return repository created earlier for the same index"""
+            if key not in self._repositories:
+                self._repositories[key] = factory(*args, **kwargs)
+            return self._repositories[key]
+        return shared_factory
+
+
+def asyncio_backend():
+    """Create AsyncioBackend importing it only when needed (Python 3.5+)"""
+    from .aiobackend import AsyncioBackend
+    return AsyncioBackend()
+
+
+BACKENDS = {
+    'asyncio': asyncio_backend,
+    'subprocess': SubprocessBackend,
+    'inprocess': InProcessBackend,
+}
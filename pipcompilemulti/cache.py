@@ -0,0 +1,124 @@
+"""Persistent cache of pip-compile output"""
+
+import os
+import errno
+import hashlib
+import logging
+import threading
+
+from .files import write_atomically
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+class ResolutionCache(object):
+    """
+    Content-addressed directory with pip-compile output files.
+    Least recently used entries are evicted when total size
+    exceeds max_size bytes.
+    """
+
+    SUFFIX = '.txt'
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(components):
+        """
+        Return hex digest of given list of byte strings.
+
+        >>> ResolutionCache.key([b'a', b'b']) == ResolutionCache.key([b'ab'])
+        False
+        """
+        sha1 = hashlib.sha1()
+        for component in components:
+            sha1.update(hashlib.sha1(component).digest())
+        return sha1.hexdigest()
+
+    def path(self, key):
+        """Path of cache entry for given key"""
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def restore(self, key, file_path):
+        """
+        Copy cache entry to file_path.
+        Return True on cache hit, False otherwise.
+        """
+        try:
+            with open(self.path(key), 'rb') as fp:
+                content = fp.read()
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            self._count(hit=False)
+            return False
+        # Mark entry as recently used,
+        # unless other process sharing directory evicted it:
+        _ignore_missing(os.utime, self.path(key), None)
+        with open(file_path, 'wb') as fp:
+            fp.write(content)
+        self._count(hit=True)
+        return True
+
+    def store(self, key, file_path):
+        """Copy file_path content to cache entry"""
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+        with open(file_path, 'rb') as fp:
+            write_atomically(self.path(key), [fp.read()], mode='wb')
+
+    def evict(self):
+        """Remove least recently used entries to fit into max_size"""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                stat = _ignore_missing(os.stat,
+                                       os.path.join(self.directory, name))
+                if stat is not None:
+                    entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            # Entry may be already evicted by other process:
+            _ignore_missing(os.remove, os.path.join(self.directory, name))
+            total_size -= size
+            logger.debug("Evicted %s from resolution cache", name)
+
+    def log_stats(self):
+        """Log number of cache hits and misses"""
+        logger.info("Resolution cache %s: %d hits, %d misses",
+                    self.directory, self.hits, self.misses)
+
+    def _count(self, hit):
+        """Thread-safe increment of hits or misses counter"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def _ignore_missing(func, *args):
+    """
+    Return func(*args), or None if file doesn't exist,
+    as other processes sharing cache directory can remove it.
+    """
+    try:
+        return func(*args)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+        return None
@@ -4,9 +4,7 @@ import logging
 
 import click
 
-from .options import OPTIONS
-from .actions import recompile
-from .verify import verify_environments
+from .options import OPTIONS, Settings
 
 
 @click.group(invoke_without_command=True)
@@ -35,9 +33,72 @@ from .verify import verify_environments
                    'references. Can be supplied multiple times.')
 @click.option('--upgrade/--no-upgrade', default=True,
               help='Upgrade package version (default true)')
+@click.option('--upgrade-package', multiple=True,
+              help='Upgrade only given package in environments locking it, '
+                   'keeping other environments untouched. '
+                   'Implies --no-upgrade. Can be supplied multiple times.')
+@click.option('--incremental/--no-incremental',
+              default=OPTIONS['incremental'],
+              help='Skip environments with up to date lockfiles '
+                   '(default false). Has no effect with --upgrade.')
+@click.option('--cache-dir', default=OPTIONS['cache_dir'],
+              help='Directory path for caching pip-compile output '
+                   'between runs (disabled by default).')
+@click.option('--cache-size', default=OPTIONS['cache_size'], type=int,
+              help='Maximum size of cache directory in megabytes '
+                   '(default 100).')
+@click.option('--backend', default=OPTIONS['backend'],
+              type=click.Choice(['subprocess', 'inprocess', 'asyncio']),
+              help='Run pip-compile in subprocess for each environment, '
+                   'or in current process sharing package repository, '
+                   'or in subprocesses streaming their output from '
+                   'asyncio event loop (default subprocess).')
+@click.option('--rebuild', default=OPTIONS['rebuild'],
+              type=click.Choice(['always', 'auto']),
+              help='Clear pip-tools caches for every environment (always), '
+                   'or only when upgrading (auto). '
+                   'Default always.')
+@click.option('--recursive/--no-recursive', default=OPTIONS['recursive'],
+              help='Discover input files in nested directories '
+                   '(default false).')
+@click.option('--discovery-cache/--no-discovery-cache',
+              default=OPTIONS['discovery_cache'],
+              help='Keep references parsed from input files in a cache '
+                   'file inside requirements directory (default false).')
+@click.option('--timeout', default=OPTIONS['timeout'], type=int,
+              help='Maximum number of seconds for single pip-compile run '
+                   '(default 0 - no limit).')
+@click.option('--retries', default=OPTIONS['retries'], type=int,
+              help='Number of times to retry failed pip-compile run '
+                   '(default 0).')
+@click.option('--retry-delay', default=OPTIONS['retry_delay'], type=int,
+              help='Seconds to wait before the first retry, '
+                   'doubled for every next one (default 1).')
+@click.option('--constraints/--no-constraints',
+              default=OPTIONS['constraints'],
+              help='Resolve environments against versions locked in '
+                   'referenced environments, passed to pip-compile as '
+                   'constraints (default false).')
+@click.option('--preflight/--no-preflight', default=OPTIONS['preflight'],
+              help='Check direct version constraints of input files and '
+                   'pins of referenced lockfiles for conflicts before '
+                   'running pip-compile (default true).')
+@click.option('--resume/--no-resume', default=OPTIONS['resume'],
+              help='Skip environments locked by previous failed or '
+                   'interrupted run, if their inputs did not change '
+                   '(default false).')
+@click.option('--jobs', '-j', default=OPTIONS['jobs'], type=int,
+              help='Number of environments to compile in parallel '
+                   '(default 1).')
 def cli(ctx, compatible, forbid_post, generate_hashes, directory,
-        in_ext, out_ext, header, only_name, upgrade):
+        in_ext, out_ext, header, only_name, upgrade, upgrade_package,
+        incremental,
+        cache_dir, cache_size, backend, rebuild, recursive,
+        discovery_cache, timeout, retries, retry_delay, constraints,
+        preflight, resume, jobs):
     """Recompile"""
+    # Click passes each command line option as an argument:
+    # pylint: disable=too-many-locals
     logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     OPTIONS.update({
         'compatible_patterns': compatible,
@@ -48,19 +109,53 @@ def cli(ctx, compatible, forbid_post, generate_hashes, directory,
         'out_ext': out_ext,
         'header_file': header or None,
         'include_names': only_name,
-        'upgrade': upgrade,
+        'upgrade': upgrade and not upgrade_package,
+        'upgrade_packages': upgrade_package,
+        'incremental': incremental,
+        'cache_dir': cache_dir,
+        'cache_size': cache_size,
+        'backend': backend,
+        'rebuild': rebuild,
+        'recursive': recursive,
+        'discovery_cache': discovery_cache,
+        'timeout': timeout,
+        'retries': retries,
+        'retry_delay': retry_delay,
+        'constraints': constraints,
+        'preflight': preflight,
+        'resume': resume,
+        'jobs': jobs,
     })
     if ctx.invoked_subcommand is None:
-        recompile()
+        from .actions import recompile
+        recompile(settings=Settings.from_options())
 
 
 @cli.command()
+@click.option('--cache/--no-cache', default=OPTIONS['verify_cache'],
+              help='Skip reading files that did not change since '
+                   'last successful verification (default false).')
 @click.pass_context
-def verify(ctx):
+def verify(ctx, cache):
     """
     For each environment verify hash comments and report failures.
     If any failure occured, exit with code 1.
     """
+    from .verify import verify_environments
+    OPTIONS['verify_cache'] = cache
     ctx.exit(0
-             if verify_environments()
+             if verify_environments(settings=Settings.from_options())
              else 1)
+
+
+@cli.command()
+@click.option('--interval', default=1.0, type=float,
+              help='Seconds between checks for changed input files '
+                   '(default 1).')
+def watch(interval):
+    """
+    Recompile environments affected by changes in input files
+    until interrupted.
+    """
+    from .watch import watch as watch_environments
+    watch_environments(interval, settings=Settings.from_options())
@@ -4,10 +4,9 @@ import logging
 
 import click
 
-from .options import OPTIONS
-from .config import read_config, read_sections
-from .actions import recompile
-from .verify import verify_environments
+from .options import OPTIONS, Settings
+from .config import read_config, read_matrix_config, read_sections
+from .planner import plan_sections, run_plan
 
 
 logger = logging.getLogger("pip-compile-multi")
@@ -19,24 +18,40 @@ def cli():
     logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
 
+MATRIX_HELP = ('Also run sections for other Python versions installed '
+               'locally, using their interpreters to run pip-compile. '
+               'Sections writing different files run concurrently.')
+
+
 @cli.command()
-def lock():
+@click.option('--matrix', is_flag=True, help=MATRIX_HELP)
+def lock(matrix):
     """Lock new dependencies without upgrading"""
     OPTIONS['upgrade'] = False
-    run_configurations(recompile, read_config)
+    OPTIONS['incremental'] = True
+    from .actions import recompile
+    run_configurations(recompile, config_reader(matrix), parallel=True)
 
 
 @cli.command()
-def upgrade():
+@click.option('--package', '-p', multiple=True,
+              help='Upgrade only given package in environments locking it, '
+                   'keeping other environments untouched. '
+                   'Can be supplied multiple times.')
+@click.option('--matrix', is_flag=True, help=MATRIX_HELP)
+def upgrade(package, matrix):
     """Upgrade locked dependency versions"""
-    OPTIONS['upgrade'] = True
-    run_configurations(recompile, read_config)
+    OPTIONS['upgrade'] = not package
+    OPTIONS['upgrade_packages'] = list(package)
+    from .actions import recompile
+    run_configurations(recompile, config_reader(matrix), parallel=True)
 
 
 @cli.command()
 @click.pass_context
 def verify(ctx):
     """Upgrade locked dependency versions"""
+    from .verify import verify_environments
     oks = run_configurations(
         skipper(verify_environments),
         read_sections,
@@ -46,37 +61,42 @@ def verify(ctx):
              else 1)
 
 
+def config_reader(matrix):
+    """Return function reading sections for current runtime,
+    or for all locally installed interpreters if matrix is True."""
+    return read_matrix_config if matrix else read_config
+
+
 def skipper(func):
-    """Decorator that memorizes base_dir, in_ext and out_ext from OPTIONS
+    """Decorator that memorizes base_dir, in_ext and out_ext from settings
     and skips execution for duplicates."""
     @functools.wraps(func)
-    def wrapped():
+    def wrapped(settings, **kwargs):
         """Dummy docstring to make pylint happy."""
-        key = (OPTIONS['base_dir'], OPTIONS['in_ext'], OPTIONS['out_ext'])
+        key = (settings['base_dir'], settings['in_ext'], settings['out_ext'])
         if key not in seen:
-            seen[key] = func()
+            seen[key] = func(settings=settings, **kwargs)
         return seen[key]
     seen = {}
     return wrapped
 
 
-def run_configurations(callback, sections_reader):
-    """Parse configurations and execute callback for matching."""
+def run_configurations(callback, sections_reader, parallel=False):
+    """Parse configurations and execute callback for matching.
+
+    Global OPTIONS serve as defaults for options of sections.
+    Sections are planned by files they read and write, and if parallel
+    is True, sections that don't share files run concurrently.
+    """
     base = dict(OPTIONS)
     sections = sections_reader()
     if sections is None:
         logger.info("Configuration not found in .ini files. "
                     "Running with default settings")
-        recompile()
-    elif sections == []:
+        from .actions import recompile
+        recompile(settings=Settings.from_options())
+        return []
+    if sections == []:
         logger.info("Configuration does not match current runtime. "
                     "Exiting")
-    results = []
-    for section, options in sections:
-        OPTIONS.clear()
-        OPTIONS.update(base)
-        OPTIONS.update(options)
-        logger.debug("Running configuration from section \"%s\". OPTIONS: %r",
-                     section, OPTIONS)
-        results.append(callback())
-    return results
+    return run_plan(plan_sections(sections, base), callback, parallel)
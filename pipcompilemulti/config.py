@@ -1,10 +1,14 @@
 """Get tasks options from INI file"""
 import sys
+import logging
 import collections
 import configparser
 import six
 
-from .options import OPTIONS
+from .options import DEFAULTS
+
+
+logger = logging.getLogger("pip-compile-multi")
 
 
 def read_config():
@@ -15,6 +19,43 @@ def read_config():
     return filter_sections(read_sections())
 
 
+def read_matrix_config():
+    """Read requirements.ini and return list of pairs (name, options)
+    for sections targeting any locally installed Python version.
+    If no requirements sections found, return None.
+    """
+    return locate_interpreters(read_sections())
+
+
+def locate_interpreters(sections):
+    """Filter through pairs (name, options)
+    leaving those that match runtime, and those that target
+    other Python versions installed locally.
+    The latter get python_executable option with path to interpreter.
+
+    If no requirements sections found, return None.
+    """
+    if not sections:
+        return None
+    from .interpreters import find_interpreter
+    jobs = []
+    matchers = python_version_matchers()
+    located = {}
+    for name, options in sections:
+        target_version = options.pop('python', None)
+        if target_version not in matchers:
+            if target_version not in located:
+                located[target_version] = find_interpreter(target_version)
+            if located[target_version] is None:
+                logger.warning("Skipping section \"%s\": "
+                               "Python %s is not found",
+                               name, target_version)
+                continue
+            options['python_executable'] = located[target_version]
+        jobs.append((name, options))
+    return jobs
+
+
 def filter_sections(sections):
     """Filter through pairs (name, options)
     leaving only those that match runtime.
@@ -51,8 +92,13 @@ def read_sections():
 
 
 def parse_value(key, value):
-    """Parse value as comma-delimited list if default value for it is list"""
-    default = OPTIONS.get(key)
+    """Parse value as comma-delimited list if default value for it is list,
+    or as boolean/integer if default value for it is boolean/integer."""
+    default = DEFAULTS.get(key)
+    if isinstance(default, bool):
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    if isinstance(default, int) and not isinstance(default, bool):
+        return int(value)
     if isinstance(default, collections.Iterable):
         if not isinstance(default, six.string_types):
             return [item.strip()
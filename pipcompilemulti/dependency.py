@@ -1,7 +1,8 @@
 """Dependency class"""
 
+import os
 import re
-from fnmatch import fnmatch
+from fnmatch import translate
 
 from .options import OPTIONS
 
@@ -9,14 +10,22 @@ from .options import OPTIONS
 class Dependency(object):
     """Single dependency line"""
 
+    # Settings are kept to match compatible_patterns on serialization
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        'valid', 'is_vcs', 'package', 'version', 'hashes', 'comment', 'line',
+        'settings',
+    )
+
     COMMENT_JUSTIFICATION = 26
 
     # Example:
     # unidecode==0.4.21         # via myapp
     # [package]  [version]      [comment]
+    # Compatible (~=) pins are parsed from existing lockfiles.
     RE_DEPENDENCY = re.compile(
         r'(?iu)(?P<package>\S+)'
-        r'=='
+        r'[=~]='
         r'(?P<version>\S+)'
         r'\s*'
         r'(?P<hashes>(?:--hash=\S+\s*)+)?'
@@ -38,7 +47,45 @@ class Dependency(object):
         r'(?P<comment>#.*)?$'
     )
 
-    def __init__(self, line):
+    # Backslash joining physical lines into one logical line:
+    RE_CONTINUATION = re.compile(r'\\[ \t]*\n[ \t]*')
+
+    # Whole requirements file is tokenized into logical lines,
+    # continuation backslashes are treated as whitespace.
+    # Each match is either dependency, VCS dependency or any other line,
+    # with the same groups as RE_DEPENDENCY and RE_VCS_DEPENDENCY.
+    _SPACES = r'[ \t\r]*(?:\\[ \t]*\n[ \t\r]*)*'
+    _WORD = r'[^\s\\]+(?:\\(?![ \t]*\n)[^\s\\]*)*'
+    _TAIL = r'[^\n\\]*(?:\\(?:[ \t]*\n)?[^\n\\]*)*'
+    RE_RECORD = re.compile(
+        r'(?imu)^{spaces}(?P<line>'
+        r'(?P<package>{word})'
+        r'[=~]='
+        r'(?P<version>{word})'
+        r'{spaces}'
+        r'(?P<hashes>(?:--hash={word}{spaces})+)?'
+        r'(?P<comment>#{tail})?'
+        r'(?=\n|\Z)'
+        r'|'
+        r'(?:-e)?'
+        r'{spaces}'
+        r'{word}#egg='
+        r'(?P<vcs_package>[a-z0-9-_.]+)'
+        r'{word}'
+        r'{spaces}'
+        r'(?P<vcs_comment>#{tail})?'
+        r'(?=\n|\Z)'
+        r'|'
+        r'{tail})'.format(spaces=_SPACES, word=_WORD, tail=_TAIL)
+    )
+
+    def __init__(self, line, settings=None):
+        """
+        line - requirement line
+        settings - Settings with compatible_patterns,
+                   global OPTIONS are used if not given
+        """
+        self.settings = settings
         regular = self.RE_DEPENDENCY.match(line)
         if regular:
             self.valid = True
@@ -59,6 +106,61 @@ class Dependency(object):
             self.line = line
             return
         self.valid = False
+        self.line = line
+
+    @classmethod
+    def parse_text(cls, text, settings=None):
+        """
+        Parse content of requirements file in a single regex pass
+        over the whole text, tokenizing it into logical lines.
+        Yield dependency for each logical line. Lines, that are not
+        dependencies, are kept in line attribute stripped
+        and with backslash-continued lines joined.
+
+        >>> [(dep.valid, dep.comment if dep.valid else dep.line)
+        ...  for dep in Dependency.parse_text(
+        ...      'six==1.0 \\\\\\n    # via x\\n# comment\\n')]
+        [(True, '# via x'), (False, '# comment')]
+        """
+        if text.rstrip().endswith('\\'):
+            # Impossible:
+            raise RuntimeError("Compiled file ends with backslash \\")
+        if not text:
+            return
+        end = len(text) - 1 if text.endswith('\n') else len(text)
+        for record in cls.RE_RECORD.finditer(text, 0, end):
+            yield cls.from_record(record, settings)
+
+    @classmethod
+    def from_record(cls, record, settings=None):
+        """
+        Create dependency from match of RE_RECORD
+        without matching its line again.
+        """
+        dep = cls.__new__(cls)
+        dep.settings = settings
+        package, vcs_package = record.group('package', 'vcs_package')
+        if package is not None:
+            dep.valid = True
+            dep.is_vcs = False
+            dep.package = package
+            dep.version = record.group('version')
+            hashes, comment = record.group('hashes', 'comment')
+            # Hashes are whitespace separated, continuations are dropped:
+            dep.hashes = hashes.replace('\\', ' ').strip() if hashes else ''
+            dep.comment = joined(comment or '')
+            return dep
+        dep.line = joined(record.group('line'))
+        if vcs_package is not None:
+            dep.valid = True
+            dep.is_vcs = True
+            dep.package = vcs_package
+            dep.version = ''
+            dep.hashes = ''
+            dep.comment = joined(record.group('vcs_comment') or '')
+        else:
+            dep.valid = False
+        return dep
 
     def serialize(self):
         """
@@ -103,13 +205,79 @@ class Dependency(object):
     @property
     def is_compatible(self):
         """Check if package name is matched by compatible_patterns"""
-        for pattern in OPTIONS['compatible_patterns']:
-            if fnmatch(self.package.lower(), pattern):
-                return True
-        return False
+        # Global OPTIONS are read directly, as building Settings
+        # from them for every dependency is slow:
+        settings = OPTIONS if self.settings is None else self.settings
+        return compatible_matcher(settings['compatible_patterns'])(self.package)
 
     def drop_post(self):
         """Remove .postXXXX postfix from version"""
-        post_index = self.version.find('.post')
-        if post_index >= 0:
-            self.version = self.version[:post_index]
+        self.version = without_post(self.version)
+
+
+def joined(text):
+    """Return stripped text with backslash-continued lines joined"""
+    if '\\' in text:
+        text = Dependency.RE_CONTINUATION.sub(' ', text)
+    return text.strip()
+
+
+def without_post(version):
+    """
+    Return version without .postXXXX postfix.
+    Lockfiles may have post-releases dropped,
+    so versions are compared without them.
+
+    >>> without_post('1.2.post1'), without_post('1.2')
+    ('1.2', '1.2')
+    """
+    post_index = version.find('.post')
+    if post_index >= 0:
+        return version[:post_index]
+    return version
+
+
+class CompatibleMatcher(object):
+    """
+    Match package names against glob patterns
+    using single regular expression and remember results.
+
+    >>> matcher = CompatibleMatcher(['pycode*', 'flake8'])
+    >>> matcher('PyCodeStyle'), matcher('flake8'), matcher('flake8-docs')
+    (True, True, False)
+    """
+
+    # Matcher is used as a function:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, patterns):
+        self.regex = None
+        if patterns:
+            self.regex = re.compile('|'.join(
+                '(?:{0})'.format(translate(os.path.normcase(pattern)))
+                for pattern in patterns
+            ))
+        self.matched = {}
+
+    def __call__(self, package):
+        """Return True if package name matches any of the patterns"""
+        try:
+            return self.matched[package]
+        except KeyError:
+            result = self.regex is not None and bool(
+                self.regex.match(os.path.normcase(package.lower()))
+            )
+            self.matched[package] = result
+            return result
+
+
+_MATCHERS = {}
+
+
+def compatible_matcher(patterns):
+    """Return CompatibleMatcher shared by all callers with the same patterns"""
+    key = tuple(patterns)
+    try:
+        return _MATCHERS[key]
+    except KeyError:
+        return _MATCHERS.setdefault(key, CompatibleMatcher(key))
@@ -2,12 +2,45 @@
 
 import os
 import glob
+import json
 
-from toposort import toposort_flatten
+from .options import Settings
 from .environment import Environment
+from .files import load_json, write_atomically
+from .graph import EnvironmentGraph
 
 
-__all__ = ('discover',)
+__all__ = ('discover', 'discover_environments')
+
+
+def discover_environments(settings=None):
+    """
+    Find input files in base_dir,
+    recursively if recursive option is set,
+    and return list of environments ordered by references.
+    Use discovery cache if discovery_cache option is set.
+    Options are read from settings, or global OPTIONS if not given.
+    """
+    if settings is None:
+        settings = Settings.from_options()
+    base_dir = settings['base_dir']
+    names = {
+        extract_nested_env_name(base_dir, path): (path, stat)
+        for path, stat in find_input_files(settings)
+    }
+    cache = None
+    if settings['discovery_cache']:
+        cache = DiscoveryCache(os.path.join(base_dir, DiscoveryCache.FILE_NAME))
+    envs = []
+    for name, (in_path, stat) in names.items():
+        if cache is None:
+            refs = Environment.parse_reference_names(name, in_path)
+        else:
+            refs = cache.references(name, in_path, stat or os.stat(in_path))
+        envs.append({'name': name, 'refs': refs})
+    if cache is not None:
+        cache.save()
+    return order_by_refs(envs)
 
 
 def discover(glob_pattern):
@@ -38,25 +71,114 @@ def discover(glob_pattern):
     ])
 
 
+def find_input_files(settings=None):
+    """
+    Yield pairs of input file path and its stat result
+    in base_dir, recursively if recursive option is set.
+    Stat result is None if it's not known without extra system call.
+    """
+    if settings is None:
+        settings = Settings.from_options()
+    base_dir, in_ext = settings['base_dir'], '.' + settings['in_ext']
+    if settings['recursive']:
+        for path, stat in find_files(base_dir, in_ext):
+            yield path, stat
+    else:
+        for path in glob.glob(os.path.join(base_dir, '*' + in_ext)):
+            yield path, None
+
+
+def find_files(directory, extension):
+    """
+    Recursively find files with given extension in directory
+    skipping hidden directories.
+    Yield pairs of file path and its stat result.
+    """
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:
+        # Python 2:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                if name.endswith(extension):
+                    path = os.path.join(root, name)
+                    yield path, os.stat(path)
+        return
+    to_visit = [directory]
+    while to_visit:
+        for entry in scandir(to_visit.pop()):
+            if entry.is_dir():
+                if not entry.name.startswith('.'):
+                    to_visit.append(entry.path)
+            elif entry.name.endswith(extension):
+                yield entry.path, entry.stat()
+
+
 def extract_env_name(file_path):
     """Return environment name for given requirements file path"""
     return os.path.splitext(os.path.basename(file_path))[0]
 
 
+def extract_nested_env_name(base_dir, file_path):
+    """
+    Return environment name for given requirements file path
+    relative to base_dir, using forward slashes for nested directories.
+
+    >>> extract_nested_env_name('requirements', 'requirements/sub/test.in')
+    'sub/test'
+    """
+    relative_path = os.path.relpath(file_path, base_dir)
+    return os.path.splitext(relative_path)[0].replace(os.sep, '/')
+
+
 def order_by_refs(envs):
     """
     Return topologicaly sorted list of environments.
     I.e. all referenced environments are placed before their references.
     """
-    topology = {
-        env['name']: set(env['refs'])
-        for env in envs
-    }
-    by_name = {
-        env['name']: env
-        for env in envs
-    }
-    return [
-        by_name[name]
-        for name in toposort_flatten(topology)
-    ]
+    return EnvironmentGraph(envs).ordered()
+
+
+class DiscoveryCache(object):
+    """
+    JSON file with references parsed from input files.
+    Entries are reused while input file size and modification time
+    stay the same.
+    """
+
+    FILE_NAME = '.pip-compile-multi-discovery.json'
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.seen = set()
+        self.entries = load_json(file_path, {})
+
+    def references(self, name, in_path, stat):
+        """Return set of names referenced by environment"""
+        self.seen.add(in_path)
+        entry = self.entries.get(in_path)
+        mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        if (entry is None or entry['name'] != name or
+                entry['size'] != stat.st_size or entry['mtime'] != mtime):
+            entry = self.entries[in_path] = {
+                'name': name,
+                'size': stat.st_size,
+                'mtime': mtime,
+                'refs': sorted(
+                    Environment.parse_reference_names(name, in_path)
+                ),
+            }
+        return set(entry['refs'])
+
+    def save(self):
+        """Write entries of existing input files to disk"""
+        if not os.path.isdir(os.path.dirname(self.file_path) or '.'):
+            return
+        entries = {
+            path: entry
+            for path, entry in self.entries.items()
+            if path in self.seen or os.path.exists(path)
+        }
+        write_atomically(self.file_path, [
+            json.dumps(entries, indent=1, sort_keys=True), '\n',
+        ])
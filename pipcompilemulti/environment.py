@@ -2,11 +2,15 @@
 
 import os
 import re
+import sys
+import shutil
+import posixpath
 import logging
-import subprocess
+import itertools
 
-from .options import OPTIONS
+from .options import Settings
 from .dependency import Dependency
+from .files import read_bytes, write_atomically
 
 
 logger = logging.getLogger("pip-compile-multi")
@@ -15,39 +19,178 @@ logger = logging.getLogger("pip-compile-multi")
 class Environment(object):
     """requirements file"""
 
+    # Environment carries per-run state of one requirements file
+    # (pins, resolution cache, backend and settings) between jobs:
+    # pylint: disable=too-many-instance-attributes
+
     RE_REF = re.compile(r'^(?:-r|--requirement)\s*(?P<path>\S+).*$')
 
-    def __init__(self, name, ignore=None, forbid_post=False, add_hashes=False):
+    def __init__(self, name, ignore=None, forbid_post=False, add_hashes=False,
+                 cache=None, backend=None, rebuild=True, constraints=None,
+                 ancestors=(), settings=None, lockfiles=None):
         """
         name - name of the environment, e.g. base, test
         ignore - set of package names to omit in output
+        cache - ResolutionCache for pip-compile output
+        backend - object running pip-compile, SubprocessBackend by default
+        rebuild - whether pip-compile should clear its caches
+        constraints - dict of package versions pip-compile must use,
+                      usually pins of referenced environments
+        ancestors - names of all environments referenced recursively,
+                    their files are part of resolution cache key
+        settings - Settings of the run, global OPTIONS if not given
+        lockfiles - dict of environment names to contents of their
+                    output files taken before any job started,
+                    read when resolving if not given
         """
         self.name = name
         self.ignore = ignore or {}
         self.forbid_post = forbid_post
         self.add_hashes = add_hashes
+        self.cache = cache
+        self._backend = backend
+        self.rebuild = rebuild
+        self.constraints = constraints
+        self.ancestors = frozenset(ancestors)
         self.packages = {}
+        self.cancelled = False
+        self._settings = settings
+        self.lockfiles = lockfiles or {}
+
+    @property
+    def settings(self):
+        """Settings of the run, current global OPTIONS if not given"""
+        if self._settings is None:
+            return Settings.from_options()
+        return self._settings
+
+    @property
+    def backend(self):
+        """Object running pip-compile, created on first use"""
+        if self._backend is None:
+            # Imported here to keep verify startup fast:
+            from .backends import SubprocessBackend
+            self._backend = SubprocessBackend()
+        return self._backend
 
-    def create_lockfile(self):
+    def create_lockfile(self, header_text='', references=()):
         """
         Write recursive dependencies list to outfile
         with hard-pinned versions.
         Then fix it.
         """
-        process = subprocess.Popen(
-            self.pin_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        stdout, stderr = process.communicate()
-        if process.returncode == 0:
-            self.fix_lockfile()
+        self.resolve()
+        self.write_lockfile(header_text, references)
+
+    def resolve(self):
+        """
+        Run pip-compile to write recursive dependencies list to resolved_file.
+        Resolution doesn't depend on ignore set,
+        so it can run before referenced environments are locked.
+        Upgrades, including upgrades of single packages, are never cached,
+        as they depend on the package index state.
+        """
+        if (self.cache is None or self.settings['upgrade'] or
+                self.settings['upgrade_packages']):
+            self.run_pip_compile()
+            return
+        key = self.cache.key(self._cache_components())
+        if self.cache.restore(key, self.resolved_file):
+            logger.debug("Restored %s from resolution cache", self.outfile)
+            return
+        self.run_pip_compile()
+        self.cache.store(key, self.resolved_file)
+
+    def run_pip_compile(self):
+        """
+        Run pip-compile using backend.
+        Existing outfile is copied to resolved_file,
+        so that pip-compile keeps locked versions when not upgrading.
+        """
+        if os.path.exists(self.outfile):
+            shutil.copyfile(self.outfile, self.resolved_file)
         else:
-            logger.critical("ERROR executing %s", ' '.join(self.pin_command))
-            logger.critical("Exit code: %s", process.returncode)
-            logger.critical(stdout.decode('utf-8'))
-            logger.critical(stderr.decode('utf-8'))
-            raise RuntimeError("Failed to pip-compile {0}".format(self.infile))
+            # Leftover from interrupted run:
+            self.remove_resolved_file()
+        if self.constraints:
+            self._write_constraints()
+        try:
+            self.backend.compile(self)
+        except Exception:
+            # Partial output must not be mistaken for resolution:
+            self.remove_resolved_file()
+            raise
+        finally:
+            if self.constraints:
+                os.remove(self.constrained_file)
+                os.remove(self.constraints_file)
+
+    def remove_resolved_file(self):
+        """Remove resolved_file if it exists"""
+        if os.path.exists(self.resolved_file):
+            os.remove(self.resolved_file)
+
+    def _write_constraints(self):
+        """
+        Write constraints to constraints_file, and constrained_file
+        referencing infile and constraints_file.
+        """
+        with open(self.constraints_file, 'wt') as fp:
+            fp.write(self._constraints_text())
+        with open(self.constrained_file, 'wt') as fp:
+            fp.write('-r {0}\n-c {1}\n'.format(
+                os.path.basename(self.infile),
+                os.path.basename(self.constraints_file),
+            ))
+
+    def _constraints_text(self):
+        """
+        Return constraints in requirements file format.
+        Packages without version, e.g. from VCS, are not constrained,
+        nor are packages locked only by inexact pins,
+        which are left out of constraints by PinTable.frozen.
+
+        >>> Environment('test', constraints={'six': '1.0', 'a': '2'}
+        ...             )._constraints_text()
+        'a==2\\nsix==1.0\\n'
+        """
+        return ''.join(
+            '{0}=={1}\n'.format(package, version)
+            for package, version in sorted((self.constraints or {}).items())
+            if version
+        )
+
+    def _cache_components(self):
+        """
+        Return list of byte strings, that determine pip-compile output:
+        command options, interpreter, constraints, contents of input files,
+        and contents of existing output files, which pip-compile
+        uses as preferred versions, as it follows -r lines of outfile.
+        Output files of references may be rewritten by parallel jobs
+        while resolving, so their contents are taken from lockfiles
+        snapshot when it's given.
+        """
+        components = [
+            ' '.join(
+                part for part in self.pin_command
+                if part not in (self.infile, self.constrained_file,
+                                self.resolved_file, '--rebuild')
+            ).encode('utf-8'),
+            '{0} {1}'.format(sys.platform, sys.version).encode('utf-8'),
+            self._constraints_text().encode('utf-8'),
+        ]
+        for name in sorted(self.ancestors | {self.name}):
+            env = Environment(name, settings=self._settings)
+            components.extend([
+                env.infile.encode('utf-8'),
+                read_bytes(env.infile),
+                env.outfile.encode('utf-8'),
+            ])
+            if name in self.lockfiles:
+                components.append(self.lockfiles[name])
+            else:
+                components.append(read_bytes(env.outfile))
+        return components
 
     @classmethod
     def parse_references(cls, filename):
@@ -70,17 +213,79 @@ class Environment(object):
                 references.add(reference_base)
         return references
 
+    @classmethod
+    def parse_reference_names(cls, name, filename):
+        """
+        Return set of names of environments referenced by filename
+        of environment with given name.
+        References in nested environments are relative
+        to their directory, e.g. ../base from sub/test is base.
+        """
+        directory = posixpath.dirname(name)
+        return set(
+            posixpath.normpath(posixpath.join(directory, reference))
+            for reference in cls.parse_references(filename)
+        )
+
+    def reference_path(self, other_name):
+        """
+        Return path of other environment outfile relative to outfile.
+
+        >>> Environment('sub/test').reference_path('base')
+        '../base.txt'
+        """
+        return '{0}.{1}'.format(
+            posixpath.relpath(other_name, posixpath.dirname(self.name) or '.'),
+            self.settings['out_ext'],
+        )
+
     @property
     def infile(self):
         """Path of the input file"""
-        return os.path.join(OPTIONS['base_dir'],
-                            '{0}.{1}'.format(self.name, OPTIONS['in_ext']))
+        settings = self.settings
+        return os.path.join(settings['base_dir'],
+                            '{0}.{1}'.format(self.name, settings['in_ext']))
 
     @property
     def outfile(self):
         """Path of the output file"""
-        return os.path.join(OPTIONS['base_dir'],
-                            '{0}.{1}'.format(self.name, OPTIONS['out_ext']))
+        settings = self.settings
+        return os.path.join(settings['base_dir'],
+                            '{0}.{1}'.format(self.name, settings['out_ext']))
+
+    @property
+    def resolved_file(self):
+        """Path of the pip-compile output file before post-processing"""
+        directory, name = os.path.split(self.outfile)
+        return os.path.join(directory, '.{0}.resolved'.format(name))
+
+    @property
+    def constraints_file(self):
+        """
+        Path of the temporary file with constraints.
+        Temporary files are named after output extension too,
+        as sections writing other files may read the same input file.
+        """
+        return self._temporary_input_file('constraints')
+
+    @property
+    def constrained_file(self):
+        """Path of the temporary input file with constraints"""
+        return self._temporary_input_file('constrained')
+
+    def _temporary_input_file(self, suffix):
+        """Return path of temporary file next to input file"""
+        directory, name = os.path.split(self.infile)
+        return os.path.join(directory, '.{0}.{1}.{2}'.format(
+            name, self.settings['out_ext'], suffix,
+        ))
+
+    @property
+    def _source_file(self):
+        """Path of the file passed to pip-compile"""
+        if self.constraints:
+            return self.constrained_file
+        return self.infile
 
     @property
     def pin_command(self):
@@ -91,44 +296,77 @@ class Environment(object):
             '--verbose',
             '--rebuild',
             '--no-index',
-            '--output-file', self.outfile,
-            self.infile,
+            '--output-file', self.resolved_file,
+            self._source_file,
         ]
-        if OPTIONS['upgrade']:
+        settings = self.settings
+        if not self.rebuild:
+            parts.remove('--rebuild')
+        if settings['upgrade']:
             parts.insert(3, '--upgrade')
+        parts[3:3] = itertools.chain.from_iterable(
+            ('--upgrade-package', package)
+            for package in settings['upgrade_packages']
+        )
         if self.add_hashes:
             parts.insert(1, '--generate-hashes')
+        if settings['python_executable']:
+            parts[:1] = [settings['python_executable'], '-m', 'piptools',
+                         'compile']
         return parts
 
-    def fix_lockfile(self):
-        """Run each line of outfile through fix_pin"""
-        with open(self.outfile, 'rt') as fp:
-            lines = [
-                self.fix_pin(line)
-                for line in self.concatenated(fp)
-            ]
-        with open(self.outfile, 'wt') as fp:
-            fp.writelines([
-                line + '\n'
-                for line in lines
-                if line is not None
-            ])
+    def write_lockfile(self, header_text, references=()):
+        """
+        Read pip-compile output from resolved_file in one pass
+        and atomically write outfile consisting of header_text,
+        references to other environments, and pip-compile output lines
+        fixed by fix_pin.
+        Existing outfile with the same content is left untouched.
+        Return True if outfile was changed.
+        """
+        try:
+            with open(self.resolved_file, 'rt') as fp:
+                return write_atomically(self.outfile, itertools.chain(
+                    [header_text],
+                    (
+                        '-r {0}\n'.format(self.reference_path(other_name))
+                        for other_name in sorted(references)
+                    ),
+                    self._fixed_body(fp),
+                ))
+        finally:
+            os.remove(self.resolved_file)
 
-    @staticmethod
-    def concatenated(fp):
-        """Read lines from fp concatenating on backslash (\\)"""
-        line_parts = []
-        for line in fp:
-            line = line.strip()
-            if line.endswith('\\'):
-                line_parts.append(line[:-1].rstrip())
-            else:
-                line_parts.append(line)
-                yield ' '.join(line_parts)
-                line_parts[:] = []
-        if line_parts:
-            # Impossible:
-            raise RuntimeError("Compiled file ends with backslash \\")
+    def _fixed_body(self, fp):
+        """
+        Run each line of pip-compile output through fix_pin
+        and yield resulting lines skipping pip-compile header.
+        """
+        header_ended = False
+        settings = self.settings
+        for dep in Dependency.parse_text(fp.read(), settings):
+            fixed = self._fix_dependency(dep)
+            if fixed is None:
+                continue
+            if not header_ended and fixed.startswith('#'):
+                continue
+            header_ended = True
+            yield fixed + '\n'
+
+    def read_packages(self):
+        """
+        Populate packages from existing outfile.
+        Return set of names of packages, which versions
+        may have post-release dropped.
+        """
+        inexact = set()
+        with open(self.outfile, 'rt') as fp:
+            for dep in Dependency.parse_text(fp.read(), self.settings):
+                if dep.valid:
+                    self.packages[dep.package] = dep.version
+                    if self.forbid_post or dep.is_compatible:
+                        inexact.add(dep.package)
+        return inexact
 
     def fix_pin(self, line):
         """
@@ -138,13 +376,18 @@ class Environment(object):
 
         Also populate packages set
         """
-        dep = Dependency(line)
+        # Without settings, dependency reads global OPTIONS itself,
+        # instead of taking their snapshot for every line:
+        return self._fix_dependency(Dependency(line, self._settings))
+
+    def _fix_dependency(self, dep):
+        """Same as fix_pin for already parsed dependency"""
         if dep.valid:
             if dep.package in self.ignore:
                 ignored_version = self.ignore[dep.package]
                 if ignored_version is not None:
                     # ignored_version can be None to disable conflict detection
-                    if dep.version and dep.version != ignored_version:
+                    if dep.version and not self._is_ignored_version(dep):
                         logger.error(
                             "Package %s was resolved to different "
                             "versions in different environments: %s and %s",
@@ -160,44 +403,15 @@ class Environment(object):
                 # Always drop post for internal packages
                 dep.drop_post()
             return dep.serialize()
-        return line.strip()
-
-    def add_references(self, other_names):
-        """Add references to other_names in outfile"""
-        if not other_names:
-            # Skip on empty list
-            return
-        with open(self.outfile, 'rt') as fp:
-            header, body = self.split_header(fp)
-        with open(self.outfile, 'wt') as fp:
-            fp.writelines(header)
-            fp.writelines(
-                '-r {0}.{1}\n'.format(other_name, OPTIONS['out_ext'])
-                for other_name in sorted(other_names)
-            )
-            fp.writelines(body)
-
-    @staticmethod
-    def split_header(fp):
-        """
-        Read file pointer and return pair of lines lists:
-        first - header, second - the rest.
-        """
-        body_start, header_ended = 0, False
-        lines = []
-        for line in fp:
-            if line.startswith('#') and not header_ended:
-                # Header text
-                body_start += 1
-            else:
-                header_ended = True
-            lines.append(line)
-        return lines[:body_start], lines[body_start:]
+        return dep.line.strip()
 
-    def replace_header(self, header_text):
-        """Replace pip-compile header with custom text"""
-        with open(self.outfile, 'rt') as fp:
-            _, body = self.split_header(fp)
-        with open(self.outfile, 'wt') as fp:
-            fp.write(header_text)
-            fp.writelines(body)
+    def _is_ignored_version(self, dep):
+        """
+        Return True if dependency version is the same as ignored one.
+        Merged pins also match versions differing only in post-release
+        from pins read from lockfiles with post-releases dropped.
+        """
+        matches = getattr(self.ignore, 'matches', None)
+        if matches is not None:
+            return matches(dep.package, dep.version)
+        return dep.version == self.ignore[dep.package]
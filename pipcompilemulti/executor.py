@@ -0,0 +1,177 @@
+"""Run jobs for environments respecting references between them"""
+
+import sys
+from multiprocessing.pool import ThreadPool
+
+import six
+from six.moves import queue
+
+
+__all__ = ('iter_completed',)
+
+
+def iter_completed(func, envs, jobs=1, wait_refs=True, failed=None,
+                   on_cancel=None):
+    """
+    Call func(env) for each environment in a pool of jobs threads.
+    Yield pairs (env, result) as soon as environment and all
+    environments it references have completed.
+    Environments are yielded from the consumer thread,
+    so results can be post-processed in topological order.
+
+    If wait_refs is True, func(env) is called only after consumer is done
+    processing all referenced environments, so it's safe to use
+    results of referenced environments inside func.
+    Otherwise func is called for all environments at once.
+
+    By default the first exception raised by func is re-raised.
+    If failed dict is given, exceptions are stored in it
+    as failed[name] = exc_info, and environments referencing failed ones
+    are cancelled: they are not started, and their results are dropped.
+    Other environments complete as usual.
+    Consumer can add its own failures to the dict to cancel dependents.
+    If on_cancel is given, on_cancel(env) is called once for each
+    cancelled environment, so that running func(env) can be interrupted.
+
+    With jobs=1 environments are processed sequentially in given order:
+
+    >>> envs = [
+    ...     {'name': 'base', 'refs': set()},
+    ...     {'name': 'test', 'refs': {'base'}},
+    ... ]
+    >>> [(env['name'], result)
+    ...  for env, result in iter_completed(lambda env: 1, envs)]
+    [('base', 1), ('test', 1)]
+    """
+    fail_fast = failed is None
+    progress = _Progress(envs, {} if fail_fast else failed, on_cancel)
+    if jobs <= 1:
+        return _iter_sequential(func, envs, progress, fail_fast)
+    return _iter_parallel(func, envs, jobs, wait_refs, progress, fail_fast)
+
+
+def _iter_sequential(func, envs, progress, fail_fast):
+    """Call func(env) for environments one by one in given order"""
+    for env in envs:
+        if progress.is_cancelled(env['name']):
+            continue
+        try:
+            result = func(env)
+        except Exception:  # pylint: disable=broad-except
+            if fail_fast:
+                raise
+            progress.failed[env['name']] = sys.exc_info()
+            continue
+        yield env, result
+
+
+def _iter_parallel(func, envs, jobs, wait_refs, progress, fail_fast):
+    """Call func(env) in pool of jobs threads yielding in topological order"""
+    pending = list(envs)
+    finished = []
+    running = set()
+    results = queue.Queue()
+    pool = ThreadPool(jobs)
+    try:
+        while pending or running:
+            pending = [
+                env for env in pending
+                if not progress.is_cancelled(env['name'])
+            ]
+            # Interrupt jobs referencing failed environments:
+            progress.check_cancelled(running)
+            for env in [env for env in pending
+                        if not wait_refs or progress.refs_done(env)]:
+                pending.remove(env)
+                pool.apply_async(_call, (func, env, results))
+                running.add(env['name'])
+            if not running:
+                if not pending:
+                    break
+                raise RuntimeError(
+                    "Circular references between environments: {0}".format(
+                        ', '.join(sorted(env['name'] for env in pending))
+                    )
+                )
+            env, result, exc_info = results.get()
+            running.remove(env['name'])
+            if exc_info is not None:
+                if fail_fast:
+                    six.reraise(*exc_info)
+                if not progress.is_cancelled(env['name']):
+                    progress.failed[env['name']] = exc_info
+                continue
+            finished.append((env, result))
+            for item in progress.pop_ordered(finished):
+                yield item
+    finally:
+        # Don't start new jobs and let running ones finish:
+        pool.terminate()
+        pool.join()
+
+
+class _Progress(object):
+    """Failed, cancelled and done environments"""
+
+    def __init__(self, envs, failed, on_cancel=None):
+        self.envs = {env['name']: env for env in envs}
+        self.refs = {
+            env['name']: set(env['refs']) & set(self.envs)
+            for env in envs
+        }
+        self.failed = failed
+        self.on_cancel = on_cancel
+        self.cancelled = set()
+        self.done = set()
+
+    def is_cancelled(self, name):
+        """
+        Return True if environment recursively references
+        failed environment, marking it as cancelled
+        and calling on_cancel for it.
+        """
+        if name not in self.cancelled and any(
+                ref in self.failed or self.is_cancelled(ref)
+                for ref in self.refs[name]):
+            self.cancelled.add(name)
+            if self.on_cancel is not None:
+                self.on_cancel(self.envs[name])
+        return name in self.cancelled
+
+    def check_cancelled(self, names):
+        """Mark environments referencing failed ones as cancelled"""
+        for name in names:
+            self.is_cancelled(name)
+
+    def refs_done(self, env):
+        """Return True if all environments referenced by env are done"""
+        return self.refs[env['name']] <= self.done
+
+    def pop_ordered(self, finished):
+        """
+        Remove finished environments with all references done
+        from the list and yield them marking as done.
+        Cancelled environments are dropped.
+        """
+        finished[:] = [
+            item for item in finished
+            if not self.is_cancelled(item[0]['name'])
+        ]
+        popped = True
+        while popped:
+            popped = False
+            for item in list(finished):
+                if self.refs_done(item[0]):
+                    finished.remove(item)
+                    popped = True
+                    if not self.is_cancelled(item[0]['name']):
+                        self.done.add(item[0]['name'])
+                        yield item
+
+
+def _call(func, env, results):
+    """Call func(env) and put outcome into results queue"""
+    try:
+        results.put((env, func(env), None))
+    except Exception:  # pylint: disable=broad-except
+        results.put((env, None, sys.exc_info()))
@@ -0,0 +1,89 @@
+"""File system helpers"""
+
+import os
+import json
+import errno
+import logging
+import filecmp
+import threading
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+def write_atomically(file_path, lines, mode='wt'):
+    """
+    Write lines to temporary file in the same directory,
+    and then rename it to file_path.
+    Readers never observe partially written file.
+
+    If file_path already has the same content, it's left untouched
+    to preserve modification time, and False is returned.
+    Otherwise return True.
+    """
+    directory, name = os.path.split(file_path)
+    tmp_path = os.path.join(directory, '.{0}.{1}.{2}.tmp'.format(
+        name, os.getpid(), threading.current_thread().ident,
+    ))
+    try:
+        # Not using tempfile to create file with default permissions:
+        with open(tmp_path, mode) as fp:
+            fp.writelines(lines)
+        if os.path.exists(file_path) and filecmp.cmp(tmp_path, file_path,
+                                                     shallow=False):
+            os.remove(tmp_path)
+            return False
+        replace_file(tmp_path, file_path)
+        return True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def replace_file(src, dst):
+    """Rename src to dst overwriting dst if it exists"""
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        replace(src, dst)
+        return
+    # Python 2 can't rename over existing file on Windows:
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def read_bytes(file_path):
+    """Return content of file, or empty bytes if file doesn't exist"""
+    try:
+        with open(file_path, 'rb') as fp:
+            return fp.read()
+    except (IOError, OSError) as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+    return b''
+
+
+def load_json(file_path, default):
+    """
+    Return content of JSON file, or default if file doesn't exist
+    or is corrupted.
+    """
+    try:
+        with open(file_path, 'rt') as fp:
+            return json.load(fp)
+    except (IOError, OSError) as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+    except ValueError:
+        logger.warning("Ignoring corrupted file %s", file_path)
+    return default
+
+
+def stat_key(stat):
+    """Return list of size, modification time and inode of file stat"""
+    return [
+        stat.st_size,
+        getattr(stat, 'st_mtime_ns', stat.st_mtime),
+        stat.st_ino,
+    ]
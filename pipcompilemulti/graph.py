@@ -0,0 +1,137 @@
+"""Graph of references between environments"""
+
+import itertools
+
+
+__all__ = ('EnvironmentGraph',)
+
+
+class EnvironmentGraph(object):
+    """
+    Index of references between environments.
+    Built once from discovered environments,
+    it memorizes transitive closures and connected clusters.
+
+    >>> graph = EnvironmentGraph([
+    ...     {'name': 'base', 'refs': set()},
+    ...     {'name': 'test', 'refs': {'base'}},
+    ...     {'name': 'local', 'refs': {'test'}},
+    ...     {'name': 'side', 'refs': set()},
+    ... ])
+    >>> sorted(graph.ancestors('local'))
+    ['base', 'test']
+    >>> sorted(graph.descendants('base'))
+    ['local', 'test']
+    >>> graph.levels()
+    [['base', 'side'], ['test'], ['local']]
+    """
+
+    def __init__(self, envs):
+        self.envs = list(envs)
+        self.refs = {
+            env['name']: frozenset(env['refs'])
+            for env in self.envs
+        }
+        for name, refs in sorted(self.refs.items()):
+            missing = refs - set(self.refs)
+            if missing:
+                raise RuntimeError(
+                    "Environment {0} references missing {1}".format(
+                        name, ', '.join(sorted(missing)),
+                    )
+                )
+        self.dependents = dict((name, set()) for name in self.refs)
+        for name, refs in self.refs.items():
+            for ref in refs:
+                self.dependents[ref].add(name)
+        self._levels = None
+        self._ancestors = {}
+        self._descendants = {}
+        self._clusters = {}
+
+    def __contains__(self, name):
+        return name in self.refs
+
+    def levels(self):
+        """
+        Return list of topological levels - sorted lists of names.
+        Environments in each level reference only previous levels.
+        Raise RuntimeError if references are circular.
+        """
+        if self._levels is None:
+            levels = []
+            remaining = dict(self.refs)
+            done = set()
+            while remaining:
+                level = sorted(
+                    name for name, refs in remaining.items()
+                    if refs <= done
+                )
+                if not level:
+                    raise RuntimeError(
+                        "Circular references between environments: "
+                        "{0}".format(' -> '.join(self._find_cycle(remaining)))
+                    )
+                for name in level:
+                    del remaining[name]
+                done.update(level)
+                levels.append(level)
+            self._levels = levels
+        return self._levels
+
+    def ordered(self):
+        """Return list of environments ordered by references"""
+        by_name = dict((env['name'], env) for env in self.envs)
+        return [
+            by_name[name]
+            for name in itertools.chain.from_iterable(self.levels())
+        ]
+
+    def ancestors(self, name):
+        """Return set of environments recursively referenced by name"""
+        if not self._ancestors:
+            for other in itertools.chain.from_iterable(self.levels()):
+                self._ancestors[other] = frozenset(itertools.chain(
+                    self.refs[other],
+                    *(self._ancestors[ref] for ref in self.refs[other])
+                ))
+        return self._ancestors[name]
+
+    def descendants(self, name):
+        """Return set of environments recursively referencing name"""
+        if not self._descendants:
+            for other in reversed(list(
+                    itertools.chain.from_iterable(self.levels()))):
+                self._descendants[other] = frozenset(itertools.chain(
+                    self.dependents[other],
+                    *(self._descendants[dep] for dep in self.dependents[other])
+                ))
+        return self._descendants[name]
+
+    def cluster(self, name):
+        """
+        Return set of all environments referencing or referenced
+        by given name directly or indirectly.
+        """
+        if name not in self.refs:
+            return frozenset([name])
+        if name not in self._clusters:
+            cluster, to_visit = set([name]), [name]
+            while to_visit:
+                current = to_visit.pop()
+                for other in self.refs[current] | self.dependents[current]:
+                    if other not in cluster:
+                        cluster.add(other)
+                        to_visit.append(other)
+            cluster = frozenset(cluster)
+            for other in cluster:
+                self._clusters[other] = cluster
+        return self._clusters[name]
+
+    @staticmethod
+    def _find_cycle(remaining):
+        """Return list of names forming a cycle, first name repeated last"""
+        path = [min(remaining)]
+        while path.count(path[-1]) < 2:
+            path.append(min(remaining[path[-1]] & set(remaining)))
+        return path[path.index(path[-1]):]
@@ -0,0 +1,89 @@
+"""Locate Python interpreters installed on this machine"""
+
+import logging
+import subprocess
+
+try:
+    from shutil import which
+except ImportError:
+    # Python 2:
+    from distutils.spawn import find_executable as which
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+VERSION_SCRIPT = 'import sys; print("%d.%d" % sys.version_info[:2])'
+
+_TARGET_VERSIONS = {}
+
+
+def find_interpreter(version):
+    """
+    Return path to Python interpreter for version written
+    as in python option of configuration section ("3", "36" or "3.6"),
+    or None if it's not found.
+    """
+    major, minor = split_version(version)
+    for name in candidate_names(major, minor):
+        path = which(name)
+        if path is None:
+            continue
+        found = interpreter_version(path)
+        if found is None:
+            continue
+        if found[0] == major and minor in (None, found[1]):
+            return path
+    return None
+
+
+def split_version(version):
+    """
+    Return pair of major and minor version, minor can be None.
+
+    >>> split_version('3'), split_version('27'), split_version('3.10')
+    (('3', None), ('2', '7'), ('3', '10'))
+    """
+    if '.' in version:
+        major, minor = version.split('.', 1)
+        return major, minor
+    return version[:1], version[1:] or None
+
+
+def candidate_names(major, minor):
+    """
+    Return executable names, under which interpreter can be installed.
+
+    >>> candidate_names('3', '6')
+    ['python3.6', 'python36']
+    >>> candidate_names('3', None)
+    ['python3', 'python']
+    """
+    if minor is None:
+        return ['python' + major, 'python']
+    return ['python{0}.{1}'.format(major, minor),
+            'python{0}{1}'.format(major, minor)]
+
+
+def interpreter_version(path):
+    """Return pair of major and minor version of interpreter, or None"""
+    try:
+        output = subprocess.check_output([path, '-c', VERSION_SCRIPT],
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        logger.debug("Failed to run %s", path)
+        return None
+    return tuple(output.decode('ascii').strip().split('.'))
+
+
+def target_version(python_executable):
+    """
+    Return version of python_executable as "X.Y" string,
+    or its path if version can't be found.
+    Versions are queried once per process.
+    """
+    if python_executable not in _TARGET_VERSIONS:
+        found = interpreter_version(python_executable)
+        _TARGET_VERSIONS[python_executable] = (
+            '.'.join(found) if found else python_executable
+        )
+    return _TARGET_VERSIONS[python_executable]
@@ -0,0 +1,79 @@
+"""Journal of environments locked by current run"""
+
+import os
+import json
+import hashlib
+
+from .files import load_json, read_bytes, write_atomically
+
+
+class Journal(object):
+    """
+    JSON file recording status and fingerprint of each compiled environment
+    as soon as it's processed, and digest of its written lockfile.
+    Pins of completed environments are read back from lockfiles on resume,
+    so lockfiles edited or partially written since are not trusted.
+    It's removed after successful run, so that failed or interrupted run
+    can be resumed without recompiling already locked environments.
+    """
+
+    FILE_NAME = '.pip-compile-multi-journal.{0}.json'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.entries = {}
+
+    @classmethod
+    def path(cls, settings):
+        """
+        Return path of journal in base_dir.
+        Journals are kept per output extension and interpreter,
+        so that sections writing different files in the same directory
+        can run concurrently.
+        """
+        target = settings['out_ext']
+        if settings['python_executable']:
+            target += '-' + os.path.basename(settings['python_executable'])
+        return os.path.join(settings['base_dir'], cls.FILE_NAME.format(target))
+
+    def load(self):
+        """Read entries recorded by previous run"""
+        self.entries = load_json(self.file_path, {})
+
+    def is_completed(self, name, fingerprint, lockfile):
+        """
+        Return True if environment was locked with the same fingerprint,
+        and its lockfile wasn't changed since.
+        """
+        entry = self.entries.get(name)
+        return (
+            entry is not None and
+            entry['status'] == self.COMPLETED and
+            entry['fingerprint'] == fingerprint and
+            entry.get('digest') == self.digest(lockfile)
+        )
+
+    def record(self, name, fingerprint, status, lockfile):
+        """Record environment status and write journal to disk"""
+        self.entries[name] = {
+            'fingerprint': fingerprint,
+            'status': status,
+            'digest': self.digest(lockfile),
+        }
+        write_atomically(self.file_path, [
+            json.dumps(self.entries, indent=1, sort_keys=True), '\n',
+        ])
+
+    @staticmethod
+    def digest(file_path):
+        """Return SHA1 hash of file content, or None if it doesn't exist"""
+        if not os.path.exists(file_path):
+            return None
+        return hashlib.sha1(read_bytes(file_path)).hexdigest()
+
+    def remove(self):
+        """Remove journal file after successful run"""
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
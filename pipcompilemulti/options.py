@@ -1,19 +1,47 @@
 """
-Global dictionary holding configuration options
+Configuration options: immutable Settings passed to library functions,
+and global OPTIONS dictionary filled by command line interfaces
 """
 
-OPTIONS = {
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+DEFAULTS = {
     'add_hashes': [],
+    'backend': 'subprocess',
     'base_dir': 'requirements',
+    'cache_dir': None,
+    'cache_size': 100,
     'compatible_patterns': [],
+    'constraints': False,
+    'discovery_cache': False,
     'forbid_post': [],
     'header_file': None,
     'in_ext': 'in',
     'include_names': [],
+    'incremental': False,
+    'jobs': 1,
     'out_ext': 'txt',
+    'preflight': True,
+    'python_executable': None,
+    'rebuild': 'always',
+    'recursive': False,
+    'resume': False,
+    'retries': 0,
+    'retry_delay': 1,
+    'timeout': 0,
     'upgrade': True,
+    'upgrade_packages': [],
+    'verify_cache': False,
 }
 
+# Mutable options of command line interfaces.
+# Library functions read them only when settings are not given explicitly.
+OPTIONS = dict(DEFAULTS)
+
 DEFAULT_HEADER = """
 #
 # This file is autogenerated by pip-compile-multi
@@ -22,3 +50,84 @@ DEFAULT_HEADER = """
 #    pip-compile-multi
 #
 """.lstrip()
+
+
+class Settings(Mapping):
+    """
+    Immutable options of a single run.
+    Options missing from constructor arguments have default values,
+    lists and sets are frozen to tuples and frozensets.
+    Settings can be safely shared between threads.
+
+    >>> settings = Settings(base_dir='deps', include_names=['base'])
+    >>> settings['base_dir'], settings['in_ext'], settings['include_names']
+    ('deps', 'in', ('base',))
+    >>> settings.replace(in_ext='txt')['in_ext']
+    'txt'
+    """
+
+    __slots__ = ('_values', '_hash')
+
+    def __init__(self, **options):
+        unknown = set(options) - set(DEFAULTS)
+        if unknown:
+            raise TypeError("Unknown options: {0}".format(
+                ', '.join(sorted(unknown))
+            ))
+        values = dict(DEFAULTS)
+        values.update(options)
+        self._values = dict(
+            (key, _freeze(value))
+            for key, value in values.items()
+        )
+        self._hash = None
+
+    @classmethod
+    def from_options(cls, options=None):
+        """
+        Create settings from dictionary of options,
+        global OPTIONS by default.
+        Unknown keys, like python in configuration sections, are ignored.
+        """
+        if options is None:
+            options = OPTIONS
+        return cls(**dict(
+            (key, value)
+            for key, value in options.items()
+            if key in DEFAULTS
+        ))
+
+    def replace(self, **changes):
+        """Return new settings with given options changed"""
+        options = dict(self._values)
+        options.update(changes)
+        return Settings(**options)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self._values.items()))
+        return self._hash
+
+    def __repr__(self):
+        return 'Settings({0})'.format(', '.join(
+            '{0}={1!r}'.format(key, value)
+            for key, value in sorted(self._values.items())
+        ))
+
+
+def _freeze(value):
+    """Return immutable copy of list or set value"""
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
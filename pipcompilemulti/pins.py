@@ -0,0 +1,192 @@
+"""Shared table of locked package versions"""
+
+import logging
+import threading
+
+from six.moves import intern
+
+from .dependency import without_post
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+class PinTable(object):
+    """
+    Locked package versions of all environments.
+
+    Package names and versions are interned and indexed by package,
+    so that merged pins of any set of environments are answered
+    without copying and re-sorting their packages.
+
+    >>> table = PinTable()
+    >>> table.add('base', {'six': '1.0', 'click': '6.7'})
+    >>> table.add('test', {'pytest': '4.2'})
+    >>> merged = table.merged(['base', 'test'])
+    >>> merged['six'], 'pytest' in merged, 'flake8' in merged
+    ('1.0', True, False)
+
+    Pins read from lockfiles of forbid_post environments and
+    compatible packages have post-releases dropped.
+    They are added as inexact, and match any post-release:
+
+    >>> table.add('old', {'six': '1.0'}, inexact={'six'})
+    >>> table.add('new', {'six': '1.0.post1'})
+    >>> table.merged(['old', 'new'])['six']
+    '1.0.post1'
+    """
+
+    def __init__(self):
+        self.packages = {}
+        self.inexact = {}
+        self.owners = {}
+        self.conflicting = set()
+        self._lock = threading.RLock()
+
+    def add(self, env_name, packages, inexact=()):
+        """
+        Set packages of environment replacing previous ones.
+        inexact - names of packages, which versions may have
+                  post-release dropped.
+        """
+        packages = dict(
+            (_intern(package), _intern(version))
+            for package, version in packages.items()
+        )
+        with self._lock:
+            self.remove(env_name)
+            self.packages[env_name] = packages
+            self.inexact[env_name] = frozenset(inexact)
+            for package, version in packages.items():
+                versions = self.owners.setdefault(package, {})
+                versions.setdefault(version, set()).add(env_name)
+                if len(versions) > 1:
+                    self.conflicting.add(package)
+
+    def remove(self, env_name):
+        """Forget packages of environment"""
+        with self._lock:
+            self.inexact.pop(env_name, None)
+            for package, version in self.packages.pop(env_name, {}).items():
+                versions = self.owners[package]
+                versions[version].discard(env_name)
+                if not versions[version]:
+                    del versions[version]
+                if not versions:
+                    del self.owners[package]
+                if len(versions) < 2:
+                    self.conflicting.discard(package)
+
+    def frozen(self, env_names, exact=False):
+        """
+        Return dict copy of merged pins of given environments.
+        Unlike merged view, it's safe to use while other threads
+        add packages.
+        exact - skip packages locked only by inexact pins,
+                which don't match post-releases with ==.
+
+        >>> table = PinTable()
+        >>> table.add('base', {'six': '1.0', 'click': '7.0'}, inexact={'six'})
+        >>> table.frozen(['base'], exact=True)
+        {'click': '7.0'}
+        """
+        with self._lock:
+            merged = self.merged(env_names)
+            return dict(
+                (package, version)
+                for package, version in merged.items()
+                if not exact or merged.versions(package)[0]
+            )
+
+    def merged(self, env_names):
+        """
+        Return read-only mapping of packages of given environments
+        to their versions.
+        Raise RuntimeError if environments have different versions
+        of the same package.
+        """
+        merged = MergedPins(self, env_names)
+        errors = []
+        with self._lock:
+            for package in sorted(self.conflicting):
+                exact, inexact = merged.versions(package)
+                versions = sorted(exact | inexact)
+                if len(versions) > 1 and not (
+                        len(exact) <= 1 and
+                        set(without_post(version) for version in exact) >=
+                        inexact):
+                    errors.append((package, versions[1], versions[0]))
+        if errors:
+            for error in errors:
+                logger.error(
+                    "Package %s was resolved to different "
+                    "versions in different environments: %s and %s",
+                    error[0], error[1], error[2],
+                )
+            raise RuntimeError(
+                "Please add constraints for the package version listed above"
+            )
+        return merged
+
+
+class MergedPins(Mapping):
+    """Read-only view of PinTable packages for a set of environments"""
+
+    def __init__(self, table, env_names):
+        self.table = table
+        self.env_names = frozenset(env_names)
+
+    def versions(self, package):
+        """
+        Return sets of exact and inexact versions of package
+        locked by environments.
+        """
+        exact, inexact = set(), set()
+        for version, owners in self.table.owners.get(package, {}).items():
+            for owner in owners & self.env_names:
+                if package in self.table.inexact[owner]:
+                    inexact.add(version)
+                else:
+                    exact.add(version)
+        return exact, inexact
+
+    def matches(self, package, version):
+        """
+        Return True if version is the same as locked one,
+        or differs only in post-release from inexact pin.
+        """
+        exact, inexact = self.versions(package)
+        if exact:
+            return version in exact
+        return without_post(version) in inexact
+
+    def __getitem__(self, package):
+        exact, inexact = self.versions(package)
+        if exact or inexact:
+            # Prefer version resolved with post-release:
+            return min(exact or inexact)
+        raise KeyError(package)
+
+    def __iter__(self):
+        seen = set()
+        for env_name in sorted(self.env_names):
+            for package in self.table.packages[env_name]:
+                if package not in seen:
+                    seen.add(package)
+                    yield package
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _intern(value):
+    """Intern strings to share them between environments"""
+    try:
+        return intern(value)
+    except TypeError:
+        return value
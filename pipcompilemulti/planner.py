@@ -0,0 +1,180 @@
+"""Execution plan for configuration sections"""
+
+import os
+import logging
+
+from .options import Settings
+from .discover import discover_environments
+from .graph import EnvironmentGraph
+from .journal import Journal
+
+
+__all__ = ('plan_sections', 'run_plan')
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+def plan_sections(sections, base_options):
+    """
+    Group configuration sections into units.
+
+    Return list of units, each unit is a list of triples
+    (index of section, section name, options).
+    Sections of one unit run sequentially in given order.
+    Sections are put in one unit, if their directories overlap, and
+    one of them reads files written by another, they write the same
+    lockfiles, or share journal. Other units run in parallel,
+    e.g. sections for different interpreters writing files
+    with different extensions to the same directory.
+    Sections with the same options as an earlier section are skipped.
+
+    >>> from pipcompilemulti.options import DEFAULTS
+    >>> units = plan_sections([
+    ...     ('a', {'base_dir': 'one'}),
+    ...     ('b', {'base_dir': 'two'}),
+    ...     ('c', {'base_dir': 'one', 'in_ext': 'txt', 'out_ext': 'hash'}),
+    ...     ('d', {'base_dir': 'two'}),
+    ... ], dict(DEFAULTS, base_dir='requirements'))
+    >>> [[name for _, name, _ in unit] for unit in units]
+    [['a', 'c'], ['b']]
+    """
+    units = []
+    seen = []
+    outputs = SectionOutputs()
+    for index, (name, options) in enumerate(sections):
+        merged = dict(base_options)
+        merged.update(options)
+        if merged in seen:
+            logger.debug("Skipping section \"%s\" with duplicate options",
+                         name)
+            continue
+        seen.append(merged)
+        conflicting = [
+            unit for unit in units
+            if any(_conflicts(merged, other, outputs)
+                   for _, _, other in unit)
+        ]
+        unit = [(index, name, merged)]
+        for other in conflicting:
+            units.remove(other)
+            unit.extend(other)
+        units.append(sorted(unit, key=lambda item: item[0]))
+    return sorted(units, key=lambda unit: unit[0][0])
+
+
+def run_plan(units, action, parallel=False):
+    """
+    Run action for each section of units.
+    If parallel is True and there are several units,
+    each unit runs in a separate thread.
+    Return list of results ordered by section index.
+
+    Action is called with keyword arguments settings of the section,
+    and env_confs with discovered environments.
+    """
+    if parallel and len(units) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(len(units))
+        try:
+            unit_results = pool.map(
+                _run_unit_args, [(unit, action) for unit in units],
+            )
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        unit_results = [run_unit(unit, action) for unit in units]
+    return [
+        result
+        for _, result in sorted(
+            (item for results in unit_results for item in results),
+            key=lambda item: item[0],
+        )
+    ]
+
+
+def run_unit(unit, action):
+    """
+    Run action for sections of unit sequentially with their settings.
+    Environments discovered for one section are reused by following
+    sections with the same input files, until some section writes files
+    with their extension.
+    Return list of pairs (index of section, result).
+    """
+    discovered = {}
+    results = []
+    for index, name, options in unit:
+        settings = Settings.from_options(options)
+        logger.debug("Running configuration from section \"%s\". %r",
+                     name, settings)
+        key = (settings['base_dir'], settings['in_ext'], settings['recursive'])
+        if key not in discovered:
+            discovered[key] = discover_environments(settings)
+        results.append((index, action(env_confs=discovered[key],
+                                      settings=settings)))
+        for key in list(discovered):
+            if key[1] == settings['out_ext']:
+                del discovered[key]
+    return results
+
+
+def _run_unit_args(args):
+    """Unpack arguments of run_unit for Pool.map"""
+    return run_unit(*args)
+
+
+class SectionOutputs(object):
+    """Lockfiles written by sections, discovered once per directory"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.discovered = {}
+
+    def __call__(self, options):
+        """Return set of normalized paths of lockfiles written by section"""
+        settings = Settings.from_options(options)
+        key = (settings['base_dir'], settings['in_ext'], settings['recursive'])
+        if key not in self.discovered:
+            self.discovered[key] = discover_environments(settings)
+        env_confs = self.discovered[key]
+        names = set(conf['name'] for conf in env_confs)
+        included = set(settings['include_names']) & names
+        if included:
+            graph = EnvironmentGraph(env_confs)
+            for name in list(included):
+                included.update(graph.ancestors(name))
+            names = included
+        return set(
+            _normalize_dir(os.path.join(
+                settings['base_dir'],
+                '{0}.{1}'.format(name, settings['out_ext']),
+            ))
+            for name in names
+        )
+
+
+def _conflicts(first, second, outputs):
+    """Return True if sections must not run concurrently"""
+    if not _overlaps(_normalize_dir(first['base_dir']),
+                     _normalize_dir(second['base_dir'])):
+        return False
+    if (first['in_ext'] == second['out_ext'] or
+            first['out_ext'] == second['in_ext']):
+        # One section reads files written by another:
+        return True
+    if Journal.path(Settings.from_options(first)) == Journal.path(
+            Settings.from_options(second)):
+        return True
+    return bool(outputs(first) & outputs(second))
+
+
+def _normalize_dir(path):
+    """Return absolute normalized directory path"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _overlaps(first, second):
+    """Return True if directories are the same, or one contains the other"""
+    first, second = sorted([first, second], key=len)
+    return first == second or second.startswith(first.rstrip(os.sep) + os.sep)
@@ -0,0 +1,278 @@
+"""Detection of conflicting constraints before running pip-compile"""
+
+import re
+import logging
+
+from .options import Settings
+from .environment import Environment
+from .dependency import Dependency, without_post
+from .verify import generate_hash_comment, parse_hash_comment
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+RE_SEPARATORS = re.compile(r'[-_.]+')
+RE_COMMENT = re.compile(r'(^|\s)#.*$')
+
+
+def check_constraints(graph, names, use_lockfiles=False, upgrading=(),
+                      settings=None):
+    """
+    Log conflicts between direct constraints of input files
+    in reference closure of each environment with given names,
+    and raise RuntimeError if there are any.
+    """
+    conflicts = find_conflicts(graph, names, use_lockfiles, upgrading,
+                               settings)
+    if not conflicts:
+        return
+    for package, version, pin_source, requirement, source in conflicts:
+        logger.error("Package %s is pinned to %s in %s, "
+                     "which conflicts with %s in %s",
+                     package, version, pin_source, requirement, source)
+    raise RuntimeError(
+        "Please add constraints for the package version listed above"
+    )
+
+
+def find_conflicts(graph, names, use_lockfiles=False, upgrading=(),
+                   settings=None):
+    """
+    Return sorted list of guaranteed conflicts as tuples
+    (package, version, pin source, requirement, requirement source).
+
+    Pins are taken from == constraints in input files,
+    and, if use_lockfiles is True, from existing lockfiles of referenced
+    environments, whose input files did not change,
+    except for packages listed in upgrading.
+    Files are located using settings, global OPTIONS if not given.
+    Each pin is checked against all constraints on the same package
+    in input files of the environment and environments it references.
+    Compatible release (~=) constraints are checked against each other,
+    and reported with version of the form ~=X.Y.
+    """
+    requirement_class = _requirement_class()
+    if requirement_class is None:
+        logger.debug("packaging is not available, skipping pre-flight check")
+        return []
+    if settings is None:
+        settings = Settings.from_options()
+    requirements = {}
+    locked = {} if use_lockfiles else None
+    upgrading = set(normalize(package) for package in upgrading)
+    conflicts = set()
+    for name in names:
+        constraints, pins = collect_constraints(
+            graph, name, requirement_class, requirements, locked, upgrading,
+            settings,
+        )
+        conflicts.update(pin_conflicts(constraints, pins))
+        conflicts.update(compatible_conflicts(constraints))
+    return sorted(conflicts)
+
+
+def collect_constraints(graph, name, requirement_class, requirements,
+                        locked, upgrading, settings):
+    """
+    Return constraints and pins of environment and environments
+    it references.
+    Constraints are dict of normalized package names to lists of pairs
+    (requirement, source), pins are list of tuples
+    (package, version, source, requirement or None for lockfile pins,
+    whether lockfile pin may have post-release dropped).
+    Parsed requirements and lockfiles are cached in requirements
+    and locked dicts, lockfiles are not used if locked is None.
+    """
+    constraints = {}
+    pins = []
+    for env_name in sorted(graph.ancestors(name) | {name}):
+        env = Environment(
+            env_name,
+            forbid_post=env_name in settings['forbid_post'],
+            settings=settings,
+        )
+        if env_name not in requirements:
+            requirements[env_name] = parse_requirements(
+                env.infile, requirement_class,
+            )
+        for key, requirement in requirements[env_name]:
+            constraints.setdefault(key, []).append((requirement, env.infile))
+            version = pinned_version(requirement)
+            if version is not None:
+                pins.append((key, version, env.infile, requirement, False))
+        if locked is None or env_name == name:
+            continue
+        if env_name not in locked:
+            locked[env_name] = locked_packages(env)
+        pins.extend(
+            (key, version, env.outfile, None, inexact)
+            for key, (version, inexact) in locked[env_name].items()
+            if key not in upgrading
+        )
+    return constraints, pins
+
+
+def pin_conflicts(constraints, pins):
+    """Yield conflicts of pins with constraints on the same package"""
+    for key, version, pin_source, pin_requirement, inexact in pins:
+        for requirement, source in constraints.get(key, ()):
+            if requirement is pin_requirement:
+                continue
+            if (pin_requirement is not None and
+                    pinned_version(requirement) is not None and
+                    (pin_source, str(pin_requirement)) >
+                    (source, str(requirement))):
+                # Report pair of conflicting pins once
+                continue
+            if inexact and _drops_post(requirement, version):
+                continue
+            if not _allows(requirement, version):
+                yield (key, version, pin_source, str(requirement), source)
+
+
+def compatible_conflicts(constraints):
+    """
+    Yield conflicts between compatible release (~=) constraints
+    on the same package, which allowed ranges don't overlap.
+    """
+    for key, items in constraints.items():
+        ranges = [
+            (compatible_range(requirement), requirement, source)
+            for requirement, source in items
+        ]
+        ranges = sorted(
+            (item for item in ranges if item[0] is not None),
+            key=lambda item: (item[2], str(item[1])),
+        )
+        for index, (first, requirement, source) in enumerate(ranges):
+            for second, other, other_source in ranges[index + 1:]:
+                if first[0] >= second[1] or second[0] >= first[1]:
+                    yield (key, str(requirement.specifier), source,
+                           str(other), other_source)
+
+
+def compatible_range(requirement):
+    """
+    Return pair of inclusive lower and exclusive upper versions allowed
+    by single compatible release (~=) specifier, or None.
+    """
+    specifiers = list(requirement.specifier)
+    if len(specifiers) != 1 or specifiers[0].operator != '~=':
+        return None
+    version_class = _version_class()
+    try:
+        lower = version_class(specifiers[0].version)
+    except Exception:  # pylint: disable=broad-except
+        return None
+    release = list(lower.release[:-1])
+    release[-1] += 1
+    upper = version_class('.'.join(str(part) for part in release) + '.dev0')
+    if lower.epoch:
+        upper = version_class('{0}!{1}'.format(lower.epoch, upper))
+    return lower, upper
+
+
+def parse_requirements(file_path, requirement_class):
+    """
+    Return list of pairs (normalized name, requirement)
+    for requirement lines of input file with version specifiers.
+    Lines with environment markers or URLs are ignored,
+    as their constraints don't always apply.
+    """
+    result = []
+    with open(file_path, 'rt') as fp:
+        text = Dependency.RE_CONTINUATION.sub(' ', fp.read())
+    for line in text.splitlines():
+        line = RE_COMMENT.sub('', line).strip()
+        if not line or line.startswith('-'):
+            continue
+        try:
+            requirement = requirement_class(line)
+        except Exception:  # pylint: disable=broad-except
+            continue
+        if requirement.marker or requirement.url or not requirement.specifier:
+            continue
+        result.append((normalize(requirement.name), requirement))
+    return result
+
+
+def locked_packages(env):
+    """
+    Return dict of normalized package names to pairs of version
+    and whether it may have post-release dropped
+    from existing lockfile, if it was generated from current input file.
+    """
+    try:
+        if parse_hash_comment(env.outfile) != generate_hash_comment(
+                env.infile):
+            return {}
+        with open(env.outfile, 'rt') as fp:
+            text = fp.read()
+    except (IOError, OSError):
+        return {}
+    return dict(
+        (normalize(dep.package),
+         (dep.version, bool(env.forbid_post or dep.is_compatible)))
+        for dep in Dependency.parse_text(text, env.settings)
+        if dep.valid and not dep.is_vcs
+    )
+
+
+def pinned_version(requirement):
+    """Return version of requirement pinned with ==, or None"""
+    specifiers = list(requirement.specifier)
+    if len(specifiers) == 1 and specifiers[0].operator == '==':
+        version = specifiers[0].version
+        if not version.endswith('*'):
+            return version
+    return None
+
+
+def normalize(name):
+    """
+    Return normalized package name for comparison.
+
+    >>> normalize('Zope.Interface')
+    'zope-interface'
+    """
+    return RE_SEPARATORS.sub('-', name).lower()
+
+
+def _allows(requirement, version):
+    """Return True if requirement allows version or version is invalid"""
+    try:
+        return requirement.specifier.contains(version, prereleases=True)
+    except Exception:  # pylint: disable=broad-except
+        return True
+
+
+def _drops_post(requirement, version):
+    """
+    Return True if locked version is the version pinned
+    by requirement with post-release dropped.
+    """
+    pinned = pinned_version(requirement)
+    return pinned is not None and without_post(pinned) == version
+
+
+def _version_class():
+    """Import Version class from the same packaging as Requirement"""
+    # pylint: disable=import-error
+    try:
+        from packaging.version import Version
+    except ImportError:
+        from pip._vendor.packaging.version import Version
+    return Version
+
+
+def _requirement_class():
+    """Import Requirement class from packaging or pip's vendored copy"""
+    # pylint: disable=import-error
+    try:
+        from packaging.requirements import Requirement
+    except ImportError:
+        try:
+            from pip._vendor.packaging.requirements import Requirement
+        except ImportError:
+            return None
+    return Requirement
@@ -1,33 +1,86 @@
 """Verify action"""
 
 import os
+import json
 import hashlib
 import logging
+import collections
 
-from .options import OPTIONS
-from .discover import discover
+from .options import Settings
+from .discover import discover_environments
 from .environment import Environment
+from .files import load_json, stat_key, write_atomically
+from .graph import EnvironmentGraph
 
 
 logger = logging.getLogger("pip-compile-multi")
 
+VERIFY_JOBS = 8
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = b' \t\n\r\x0b\x0c'
 
-def verify_environments():
+
+# Result of environment verification.
+# expected and found hash comments are None if files didn't change
+# since last verification recorded in verify cache.
+VerifyResult = collections.namedtuple(
+    'VerifyResult', 'name infile outfile ok expected found',
+)
+
+
+def verify_environments(env_confs=None, settings=None):
     """
     For each environment verify hash comments and report failures.
     If any failure occured, exit with code 1.
+    env_confs - environments returned by discover_environments(),
+                discovered if not given.
+    settings - Settings of the run, global OPTIONS if not given.
     """
-    env_confs = discover(
-        os.path.join(
-            OPTIONS['base_dir'],
-            '*.' + OPTIONS['in_ext'],
-        )
+    return all(
+        result.ok
+        for result in check_environments(env_confs, settings)
     )
-    success = True
-    for conf in env_confs:
-        env = Environment(name=conf['name'])
-        current_comment = generate_hash_comment(env.infile)
-        existing_comment = parse_hash_comment(env.outfile)
+
+
+def check_environments(env_confs=None, settings=None):
+    """
+    Verify hash comments of environments, log and return list of
+    VerifyResult in order of references.
+    Arguments are the same as for verify_environments.
+    """
+    if settings is None:
+        settings = Settings.from_options()
+    if env_confs is None:
+        # With verify cache unchanged input files are not read at all,
+        # so their references are taken from discovery cache too:
+        env_confs = discover_environments(settings.replace(
+            discovery_cache=(settings['discovery_cache'] or
+                             settings['verify_cache']),
+        ))
+    graph = EnvironmentGraph(env_confs)
+    envs = [
+        Environment(name=conf['name'], settings=settings)
+        for conf in graph.envs
+    ]
+    cache = None
+    if settings['verify_cache']:
+        cache = VerifyCache(
+            os.path.join(settings['base_dir'], VerifyCache.FILE_NAME)
+        )
+    pending = [
+        env for env in envs
+        if cache is None or not cache.is_verified(env)
+    ]
+    checked = dict(zip(
+        (env.name for env in pending),
+        _map_threads(check_hash_comments, pending),
+    ))
+    results = []
+    for env in envs:
+        # Comments are None if confirmed by cache:
+        stats, current_comment, existing_comment = checked.get(
+            env.name, (None, None, None),
+        )
         if current_comment == existing_comment:
             logger.info("OK - %s was generated from %s.",
                         env.outfile, env.infile)
@@ -36,8 +89,99 @@ def verify_environments():
                          env.outfile, env.infile)
             logger.error("Expecting: %s", current_comment.strip())
             logger.error("Found:     %s", existing_comment.strip())
-            success = False
-    return success
+            stats = None
+        if cache is not None and env.name in checked:
+            cache.update(env, stats)
+        results.append(VerifyResult(
+            name=env.name,
+            infile=env.infile,
+            outfile=env.outfile,
+            ok=current_comment == existing_comment,
+            expected=current_comment,
+            found=existing_comment,
+        ))
+    if cache is not None:
+        cache.save()
+    return results
+
+
+def check_hash_comments(env):
+    """
+    Return stats of environment files taken before reading them,
+    expected and existing hash comments.
+    """
+    stats = VerifyCache.stats(env)
+    current_comment, existing_comment = compare_hash_comments(env)
+    return stats, current_comment, existing_comment
+
+
+def compare_hash_comments(env):
+    """Return pair of expected and existing hash comments of environment"""
+    return generate_hash_comment(env.infile), parse_hash_comment(env.outfile)
+
+
+def _map_threads(func, items):
+    """Return list of func results for items computed in thread pool"""
+    if len(items) < 2:
+        return [func(item) for item in items]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(len(items), VERIFY_JOBS))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class VerifyCache(object):
+    """
+    JSON file with stats of verified input and output files.
+    Pairs of files with the same size, modification time and inode
+    are confirmed without reading them.
+    """
+
+    FILE_NAME = '.pip-compile-multi-verify.json'
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.entries = load_json(file_path, {})
+
+    def is_verified(self, env):
+        """Return True if files didn't change since last verification"""
+        entry = self.entries.get(env.outfile)
+        return entry is not None and entry == self.stats(env)
+
+    def update(self, env, stats):
+        """
+        Remember stats of files taken before their verification,
+        or forget environment if stats are None.
+        """
+        if stats is None:
+            self.entries.pop(env.outfile, None)
+        else:
+            self.entries[env.outfile] = stats
+
+    def save(self):
+        """Write entries of verified environments to disk"""
+        if not os.path.isdir(os.path.dirname(self.file_path) or '.'):
+            return
+        write_atomically(self.file_path, [
+            json.dumps(self.entries, indent=1, sort_keys=True), '\n',
+        ])
+
+    @staticmethod
+    def stats(env):
+        """
+        Return stats of input and output files as JSON-friendly dict,
+        or None if files don't exist.
+        """
+        try:
+            return {
+                'infile': stat_key(os.stat(env.infile)),
+                'outfile': stat_key(os.stat(env.outfile)),
+            }
+        except OSError:
+            return None
 
 
 def generate_hash_comment(file_path):
@@ -48,9 +192,53 @@ def generate_hash_comment(file_path):
 
     which is hex representation of SHA1 file content hash
     """
+    sha1 = hashlib.sha1()
     with open(file_path, 'rb') as fp:
-        hexdigest = hashlib.sha1(fp.read().strip()).hexdigest()
-    return "# SHA1:{0}\n".format(hexdigest)
+        for chunk in iter_stripped(fp):
+            sha1.update(chunk)
+    return "# SHA1:{0}\n".format(sha1.hexdigest())
+
+
+def iter_stripped(fp, chunk_size=CHUNK_SIZE):
+    """
+    Read binary file in chunks and yield its content
+    without leading and trailing whitespace, same as fp.read().strip().
+
+    >>> import io
+    >>> content = b' \\n a b \\n c\\n\\n '
+    >>> b''.join(iter_stripped(io.BytesIO(content), 2)) == content.strip()
+    True
+    """
+    started = False
+    whitespace = b''
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+        if not started:
+            chunk = chunk.lstrip(WHITESPACE)
+            if not chunk:
+                continue
+            started = True
+        stripped = chunk.rstrip(WHITESPACE)
+        if stripped:
+            yield whitespace + stripped
+            whitespace = chunk[len(stripped):]
+        else:
+            whitespace += chunk
+
+
+def generate_fingerprint_comment(file_path, components):
+    """
+    Return string of format
+
+        # Fingerprint:da39a3ee5e6b4b0d3255bfef95601890afd80709
+
+    which is hex representation of SHA1 hash of file content
+    combined with given list of string components.
+    """
+    sha1 = hashlib.sha1(generate_hash_comment(file_path).encode('utf-8'))
+    for component in components:
+        sha1.update(b'\0')
+        sha1.update(component.encode('utf-8'))
+    return "# Fingerprint:{0}\n".format(sha1.hexdigest())
 
 
 def parse_hash_comment(file_path):
@@ -60,8 +248,26 @@ def parse_hash_comment(file_path):
 
         # SHA1:da39a3ee5e6b4b0d3255bfef95601890afd80709
     """
+    return parse_comment(file_path, "# SHA1:")
+
+
+def parse_fingerprint_comment(file_path):
+    """
+    Read file with given file_path line by line,
+    return the first line that starts with "# Fingerprint:", like this:
+
+        # Fingerprint:da39a3ee5e6b4b0d3255bfef95601890afd80709
+    """
+    return parse_comment(file_path, "# Fingerprint:")
+
+
+def parse_comment(file_path, prefix):
+    """
+    Read file with given file_path line by line,
+    return the first line that starts with prefix.
+    """
     with open(file_path) as fp:
         for line in fp:
-            if line.startswith("# SHA1:"):
+            if line.startswith(prefix):
                 return line
     return None
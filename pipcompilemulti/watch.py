@@ -0,0 +1,88 @@
+"""Watch input files and recompile affected environments"""
+
+import os
+import time
+import logging
+
+from .options import Settings
+from .actions import recompile
+from .discover import find_input_files, extract_nested_env_name
+from .pins import PinTable
+
+
+logger = logging.getLogger("pip-compile-multi")
+
+
+def watch(interval=1.0, iterations=None, settings=None):
+    """
+    Compile all environments and poll input files every interval seconds.
+    When input files change, recompile only their environments and
+    environments referencing them, reusing pins of other environments.
+    Failures are logged and changed environments are retried
+    after the next change.
+    iterations limits number of polls, it's unlimited by default.
+    settings are global OPTIONS if not given.
+    """
+    if settings is None:
+        settings = Settings.from_options()
+    pins = PinTable()
+    snapshot = take_snapshot(settings)
+    # None means all environments:
+    modified = None
+    pending = True
+    while True:
+        if pending:
+            pending = False
+            try:
+                recompile(pins=pins, modified=modified, settings=settings)
+            except RuntimeError as exc:
+                logger.error("%s. Waiting for changes.", exc)
+                if modified is None:
+                    # Pins are incomplete, start from scratch:
+                    pins = PinTable()
+            else:
+                modified = set()
+            logger.info("Watching %s for changes. Press Ctrl+C to stop.",
+                        settings['base_dir'])
+        if iterations is not None:
+            if iterations <= 0:
+                return
+            iterations -= 1
+        time.sleep(interval)
+        current = take_snapshot(settings)
+        names = changed_names(snapshot, current)
+        snapshot = current
+        if names:
+            logger.info("Detected changes in %s", ', '.join(sorted(names)))
+            pending = True
+            for name in names:
+                pins.remove(name)
+            if modified is not None:
+                modified.update(names)
+
+
+def take_snapshot(settings):
+    """Return dict of environment names to their input file stats"""
+    snapshot = {}
+    for path, stat in find_input_files(settings):
+        stat = stat or os.stat(path)
+        snapshot[extract_nested_env_name(settings['base_dir'], path)] = (
+            stat.st_size, stat.st_mtime,
+        )
+    return snapshot
+
+
+def changed_names(old, new):
+    """
+    Return set of environment names added, removed or changed
+    between two snapshots.
+
+    >>> sorted(changed_names({'a': 1, 'b': 2, 'c': 3},
+    ...                      {'a': 1, 'b': 4, 'd': 5}))
+    ['b', 'c', 'd']
+    """
+    return set(
+        name
+        for name in set(old) | set(new)
+        if old.get(name) != new.get(name)
+    )
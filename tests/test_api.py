@@ -0,0 +1,82 @@
+"""Tests for programmatic API"""
+
+import os
+import sys
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import pytest
+
+from pipcompilemulti.options import OPTIONS, Settings
+from pipcompilemulti import api
+from pipcompilemulti.backends import BACKENDS
+
+
+class PinningBackend(object):
+    """Backend writing pip-compile output without running it"""
+
+    def compile(self, env):
+        """Pin every requirement of input file to base directory name"""
+        version = os.path.basename(env.settings['base_dir'])
+        with open(env.infile) as fp:
+            packages = [line.strip() for line in fp if line.strip()]
+        with open(env.resolved_file, 'w') as fp:
+            for package in packages:
+                fp.write('{0}=={1}\n'.format(package, version))
+
+    def kill(self, env):
+        """Nothing to kill"""
+
+    def close(self):
+        """Nothing to release"""
+
+
+@pytest.mark.skipif(sys.version_info < (3, 4), reason='requires asyncio')
+def test_api_compiles_concurrently_without_options(tmpdir):
+    """Check that runs with different settings don't affect each other"""
+    import asyncio
+    settings = []
+    for version in ('1.0', '2.0'):
+        tmpdir.mkdir(version).join('base.in').write('six\n')
+        settings.append(Settings(base_dir=str(tmpdir.join(version)),
+                                 backend='pinning', jobs=2))
+    options = dict(OPTIONS)
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        with mock.patch.dict(BACKENDS, {'pinning': PinningBackend}):
+            results = run_in_loop(loop, lambda: asyncio.gather(*[
+                api.compile_environments_async(item) for item in settings
+            ]))
+            verified = run_in_loop(
+                loop, lambda: api.verify_async(settings[0]),
+            )
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    assert OPTIONS == options
+    assert [result.packages for result in results] == [
+        {'base': {'six': '1.0'}}, {'base': {'six': '2.0'}},
+    ]
+    assert results[1].changed == [str(tmpdir.join('2.0', 'base.txt'))]
+    assert [(result.name, result.ok) for result in verified] == [
+        ('base', True),
+    ]
+
+
+def run_in_loop(loop, make_future):
+    """Return result of future created by make_future in running loop"""
+    import asyncio
+    created = []
+    loop.call_soon(lambda: created.append(make_future()))
+    loop.run_until_complete(asyncio.sleep(0))
+    return loop.run_until_complete(created[0])
+
+
+def test_api_refuses_inprocess_backend(tmpdir):
+    """Check that backend replacing sys.stdout is not used by library"""
+    settings = Settings(base_dir=str(tmpdir), backend='inprocess')
+    with pytest.raises(RuntimeError):
+        api.compile_environments(settings)
@@ -0,0 +1,121 @@
+"""Tests for backends running pip-compile"""
+
+import sys
+import optparse
+import threading
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import pytest
+
+from pipcompilemulti.options import Settings
+from pipcompilemulti.backends import (
+    BACKENDS,
+    InProcessBackend,
+    SubprocessBackend,
+)
+
+
+def test_subprocess_backend_timeout():
+    """Check that hanging pip-compile is killed"""
+    env = mock.Mock(infile='base.in', settings=Settings(timeout=1),
+                    pin_command=[
+                        sys.executable, '-c', 'import time; time.sleep(10)',
+                    ])
+    with pytest.raises(RuntimeError) as excinfo:
+        SubprocessBackend().compile(env)
+    assert 'Timed out after 1 seconds' in str(excinfo.value)
+
+
+@pytest.mark.parametrize('backend_name', ['subprocess', 'asyncio'])
+def test_backend_kills_cancelled_command(backend_name):
+    """Check that running pip-compile is killed when cancelled"""
+    if backend_name == 'asyncio' and sys.version_info < (3, 5):
+        pytest.skip('requires asyncio')
+    backend = BACKENDS[backend_name]()
+    env = mock.Mock(infile='base.in', settings=Settings(timeout=0),
+                    pin_command=[
+                        sys.executable, '-c', 'import time; time.sleep(10)',
+                    ])
+    env.name = 'base'
+    timer = threading.Timer(0.5, backend.kill, [env])
+    timer.start()
+    try:
+        with pytest.raises(RuntimeError) as excinfo:
+            backend.compile(env)
+    finally:
+        timer.cancel()
+        backend.close()
+    assert 'Cancelled' in str(excinfo.value)
+
+
+def test_inprocess_backend_shares_repository():
+    """Check that repository is created once for the same index"""
+    factory = mock.Mock(side_effect=lambda *args: object())
+    backend = InProcessBackend()
+    key = backend.repository_key(['--no-index', 'base.in'])
+    # pylint: disable=protected-access
+    repositories = [
+        # pip-tools creates new options and session for every run
+        backend._shared(factory, key)(
+            optparse.Values({'index_url': None}), object(),
+        )
+        for _ in range(2)
+    ]
+    assert repositories[0] is repositories[1]
+    other_key = backend.repository_key(['-i', 'http://localhost/simple'])
+    assert backend._shared(factory, other_key)(
+        optparse.Values({'index_url': None}), object(),
+    ) is not repositories[0]
+    assert factory.call_count == 2
+
+
+@pytest.mark.parametrize('args, key', [
+    (['--no-index', '--verbose', 'base.in'], ()),
+    (['-i', 'http://a', '--pre', 'base.in'], ('-i=http://a', '--pre')),
+    (['--find-links=dist', 'base.in'], ('--find-links=dist',)),
+])
+def test_inprocess_backend_repository_key(args, key):
+    """Check that only index options are used as repository key"""
+    assert InProcessBackend.repository_key(args) == key
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason='requires asyncio')
+def test_asyncio_backend_keeps_last_output_lines():
+    """Check that failed command output is truncated to last lines"""
+    from pipcompilemulti.aiobackend import AsyncioBackend
+    backend = AsyncioBackend()
+    backend.OUTPUT_LINES = 2
+    env = mock.Mock(infile='base.in', settings=Settings(), pin_command=[
+        sys.executable, '-c',
+        'import sys; print("1\\n2"); sys.stderr.write("3\\n"); sys.exit(3)',
+    ])
+    try:
+        with mock.patch('pipcompilemulti.aiobackend.logger') as logger:
+            with pytest.raises(RuntimeError):
+                backend.compile(env)
+    finally:
+        backend.close()
+    logger.critical.assert_any_call('Exit code: %s', 3)
+    output = logger.critical.call_args_list[-1][0][0].split('\n')
+    assert len(output) == 2 and '3' in output
+    assert not backend.thread.is_alive()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason='requires asyncio')
+def test_asyncio_backend_kills_command_on_timeout():
+    """Check that command running longer than timeout is killed"""
+    from pipcompilemulti.aiobackend import AsyncioBackend
+    backend = AsyncioBackend()
+    env = mock.Mock(infile='base.in', settings=Settings(timeout=0.1),
+                    pin_command=[sys.executable, '-c',
+                                 'import time; time.sleep(10)'])
+    try:
+        with mock.patch('pipcompilemulti.aiobackend.logger'):
+            with pytest.raises(RuntimeError) as excinfo:
+                backend.compile(env)
+    finally:
+        backend.close()
+    assert 'Timed out' in str(excinfo.value)
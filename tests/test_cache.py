@@ -0,0 +1,100 @@
+"""Tests for pip-compile resolution cache"""
+
+import os
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pipcompilemulti.cache import ResolutionCache
+from pipcompilemulti.environment import Environment
+from pipcompilemulti.options import Settings
+
+
+def test_resolution_cache_evicts_least_recently_used(tmpdir):
+    """Check that cache entries are restored and evicted"""
+    source = tmpdir.join('source.txt')
+    source.write('x' * 10)
+    cache = ResolutionCache(str(tmpdir.join('cache')), max_size=15)
+    target = str(tmpdir.join('target.txt'))
+    assert not cache.restore('old', target)
+    cache.store('old', str(source))
+    os.utime(cache.path('old'), (0, 0))
+    cache.store('new', str(source))
+    assert cache.restore('new', target)
+    assert tmpdir.join('target.txt').read() == 'x' * 10
+    cache.evict()
+    assert not os.path.exists(cache.path('old'))
+    assert os.path.exists(cache.path('new'))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_resolution_cache_ignores_entries_removed_by_other_process(tmpdir):
+    """Check that entries disappearing from shared cache are skipped"""
+    source = tmpdir.join('source.txt')
+    source.write('x' * 10)
+    cache = ResolutionCache(str(tmpdir.join('cache')), max_size=0)
+    target = str(tmpdir.join('target.txt'))
+    for key in ('first', 'second'):
+        cache.store(key, str(source))
+
+    def remove_first(func):
+        """Remove first entry before calling func for cache entries"""
+        def removing(path, *args):
+            """Emulate other process evicting entry"""
+            if path.endswith(ResolutionCache.SUFFIX):
+                try:
+                    os.unlink(cache.path('first'))
+                except OSError:
+                    pass
+            return func(path, *args)
+        return removing
+
+    with mock.patch('os.utime', remove_first(os.utime)):
+        assert cache.restore('first', target)
+    cache.store('first', str(source))
+    with mock.patch('os.stat', remove_first(os.stat)):
+        cache.evict()
+    cache.store('first', str(source))
+    with mock.patch('os.remove', remove_first(os.remove)):
+        cache.evict()
+    assert not os.listdir(cache.directory)
+
+
+def test_resolution_cache_key_covers_ancestors(tmpdir):
+    """
+    Check that changed referenced input and output files
+    invalidate cache entry.
+    """
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\npytest\n')
+    cache = ResolutionCache(str(tmpdir.join('cache')), max_size=0)
+
+    def compile_env(env):
+        """Write pip-compile output"""
+        with open(env.resolved_file, 'w') as fp:
+            fp.write('pytest==4.2\n')
+
+    backend = mock.Mock(compile=mock.Mock(side_effect=compile_env))
+
+    def resolve(lockfiles=None):
+        """Resolve test environment, which references base"""
+        Environment('test', cache=cache, backend=backend, ancestors={'base'},
+                    settings=Settings(base_dir=str(tmpdir), upgrade=False),
+                    lockfiles=lockfiles).resolve()
+
+    with mock.patch.object(Environment, 'parse_reference_names') as parse:
+        resolve()
+        resolve()
+        assert backend.compile.call_count == 1
+        tmpdir.join('base.txt').write('six==1.0\n')
+        resolve()
+        assert backend.compile.call_count == 2
+        tmpdir.join('base.in').write('six\nclick\n')
+        resolve()
+        assert backend.compile.call_count == 3
+        # Lockfile rewritten by parallel job doesn't change the key:
+        tmpdir.join('base.txt').write('six==2.0\n')
+        resolve(lockfiles={'base': b'six==1.0\n'})
+        assert backend.compile.call_count == 3
+    assert not parse.called
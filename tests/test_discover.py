@@ -0,0 +1,45 @@
+"""Tests for environment discovery"""
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pipcompilemulti.environment import Environment
+from pipcompilemulti.options import OPTIONS
+from pipcompilemulti.discover import discover_environments
+
+
+def test_discover_nested_environments(tmpdir):
+    """Check that nested references are relative to referencing file"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.mkdir('api').join('test.in').write('-r ../base.in\npytest\n')
+    tmpdir.mkdir('.hidden').join('skip.in').write('')
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir),
+                                   'recursive': True}):
+        envs = discover_environments()
+        assert Environment('api/test').reference_path('base') == '../base.txt'
+    assert envs == [
+        {'name': 'base', 'refs': set()},
+        {'name': 'api/test', 'refs': {'base'}},
+    ]
+
+
+def test_discovery_cache_rereads_changed_files(tmpdir):
+    """Check that only changed input files are parsed again"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\n')
+    options = {'base_dir': str(tmpdir), 'discovery_cache': True}
+    parse = Environment.parse_references
+    with mock.patch.dict(OPTIONS, options), \
+            mock.patch.object(Environment, 'parse_references',
+                              side_effect=parse) as parse_mock:
+        discover_environments()
+        assert parse_mock.call_count == 2
+        discover_environments()
+        assert parse_mock.call_count == 2
+        tmpdir.join('test.in').write('-r base.in\npytest\n')
+        envs = discover_environments()
+        assert parse_mock.call_count == 3
+    assert envs[-1] == {'name': 'test', 'refs': {'base'}}
+    assert tmpdir.join('.pip-compile-multi-discovery.json').check()
@@ -0,0 +1,111 @@
+"""Tests for running jobs for environments"""
+
+import threading
+
+import pytest
+
+from pipcompilemulti.executor import iter_completed
+
+
+def test_parallel_jobs_wait_for_references():
+    """Check that environment is processed after all its references"""
+    envs = [
+        {'name': 'base', 'refs': set()},
+        {'name': 'py27', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+        {'name': 'local', 'refs': {'test', 'py27'}},
+    ]
+    completed = []
+    for env, result in iter_completed(lambda env: env['name'], envs, jobs=3):
+        assert env['refs'] <= set(completed)
+        completed.append(result)
+    assert sorted(completed) == ['base', 'local', 'py27', 'test']
+
+
+def test_parallel_jobs_propagate_errors():
+    """Check that exception raised in job is re-raised"""
+    def job(env):
+        """Fail for base"""
+        if env['name'] == 'base':
+            raise RuntimeError("Please add constraints")
+        return env['name']
+    envs = [
+        {'name': 'base', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+    ]
+    with pytest.raises(RuntimeError):
+        list(iter_completed(job, envs, jobs=2))
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_failed_job_cancels_only_dependents(jobs):
+    """Check that unrelated environments complete after failure"""
+    def job(env):
+        """Fail for base"""
+        if env['name'] == 'base':
+            raise RuntimeError("Please add constraints")
+        return env['name']
+    envs = [
+        {'name': 'base', 'refs': set()},
+        {'name': 'py27', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+        {'name': 'local', 'refs': {'test', 'py27'}},
+        {'name': 'py27test', 'refs': {'py27'}},
+    ]
+    failed = {}
+    completed = [
+        env['name']
+        for env, _ in iter_completed(job, envs, jobs=jobs, failed=failed)
+    ]
+    assert sorted(completed) == ['py27', 'py27test']
+    assert list(failed) == ['base']
+
+
+def test_failed_job_interrupts_running_dependents():
+    """Check that running jobs referencing failed environment are killed"""
+    started = threading.Event()
+    killed = threading.Event()
+
+    def job(env):
+        """Fail base after test has started, wait for test to be killed"""
+        if env['name'] == 'base':
+            started.wait(10)
+            raise RuntimeError("Please add constraints")
+        started.set()
+        if not killed.wait(10):
+            return env['name']
+        raise RuntimeError("Cancelled pip-compile")
+
+    envs = [
+        {'name': 'base', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+    ]
+    cancelled = []
+
+    def kill(env):
+        """Remember cancelled environment and interrupt its job"""
+        cancelled.append(env['name'])
+        killed.set()
+
+    failed = {}
+    completed = list(iter_completed(job, envs, jobs=2, wait_refs=False,
+                                    failed=failed, on_cancel=kill))
+    assert completed == []
+    assert list(failed) == ['base']
+    assert cancelled == ['test']
+
+
+def test_parallel_jobs_yield_in_topological_order():
+    """Check that jobs not waiting for references are yielded in order"""
+    envs = [
+        {'name': 'base', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+        {'name': 'local', 'refs': {'test'}},
+    ]
+    started = []
+    yielded = []
+    for env, _ in iter_completed(lambda env: started.append(env['name']),
+                                 envs, jobs=3, wait_refs=False):
+        yielded.append(env['name'])
+    assert sorted(started) == ['base', 'local', 'test']
+    assert yielded == ['base', 'test', 'local']
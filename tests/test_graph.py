@@ -0,0 +1,25 @@
+"""Tests for environment reference graph"""
+
+import pytest
+
+from pipcompilemulti.graph import EnvironmentGraph
+
+
+def test_graph_reports_circular_references():
+    """Check that cycle is named in error message"""
+    graph = EnvironmentGraph([
+        {'name': 'base', 'refs': set()},
+        {'name': 'a', 'refs': {'base', 'c'}},
+        {'name': 'b', 'refs': {'a'}},
+        {'name': 'c', 'refs': {'b'}},
+    ])
+    with pytest.raises(RuntimeError) as excinfo:
+        graph.levels()
+    assert 'a -> c -> b -> a' in str(excinfo.value)
+
+
+def test_graph_reports_missing_references():
+    """Check that reference to unknown environment is reported"""
+    with pytest.raises(RuntimeError) as excinfo:
+        EnvironmentGraph([{'name': 'test', 'refs': {'base'}}])
+    assert 'test references missing base' in str(excinfo.value)
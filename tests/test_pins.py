@@ -0,0 +1,66 @@
+"""Tests for shared table of locked package versions"""
+
+import pytest
+
+from pipcompilemulti.environment import Environment
+from pipcompilemulti.actions import merged_packages
+from pipcompilemulti.pins import PinTable
+
+
+def test_merged_pins_keep_locked_post_releases():
+    """Check that pins are returned as locked, e.g. for constraints"""
+    assert merged_packages(
+        {'base': {'foo': '1.0.post1'}}, ['base'],
+    ) == {'foo': '1.0.post1'}
+    table = PinTable()
+    table.add('base', {'six': '1.0.post1'})
+    assert table.frozen(['base']) == {'six': '1.0.post1'}
+
+
+def test_pin_table_updates_conflicts_incrementally():
+    """Check that replacing environment pins resolves conflict"""
+    table = PinTable()
+    table.add('a', {'x': '1', 'y': '1'})
+    table.add('b', {'x': '2'})
+    assert table.merged(['a'])['x'] == '1'
+    with pytest.raises(RuntimeError):
+        table.merged(['a', 'b'])
+    table.add('b', {'x': '1', 'z': '3'})
+    merged = table.merged(['a', 'b'])
+    assert dict(merged) == {'x': '1', 'y': '1', 'z': '3'}
+
+
+def test_post_release_dropped_in_lockfile_is_not_conflict():
+    """Check that pins read from lockfile without post-release match"""
+    table = PinTable()
+    table.add('base', {'six': '1.2'}, inexact={'six'})
+    table.add('test', {'six': '1.2.post1', 'pytest': '4.2'})
+    assert table.merged(['base', 'test'])['six'] == '1.2.post1'
+    env = Environment('test', ignore=table.merged(['base']))
+    assert env.fix_pin('six==1.2.post1') is None
+    with pytest.raises(RuntimeError):
+        env.fix_pin('six==1.3.post1')
+
+
+def test_resolved_post_release_is_conflict():
+    """Check that resolved versions must match including post-release"""
+    table = PinTable()
+    table.add('base', {'six': '1.2.post1'})
+    table.add('test', {'six': '1.2'})
+    with pytest.raises(RuntimeError):
+        table.merged(['base', 'test'])
+    env = Environment('test', ignore=table.merged(['base']))
+    with pytest.raises(RuntimeError):
+        env.fix_pin('six==1.2')
+
+
+def test_inexact_pins_are_not_constraints():
+    """Check that pins with dropped post-release are not constrained"""
+    table = PinTable()
+    table.add('base', {'six': '1.0', 'click': '7.0'}, inexact={'six'})
+    table.add('docs', {'six': '1.0.post1'})
+    env = Environment('test', constraints=table.frozen(['base'], exact=True))
+    # pylint: disable=protected-access
+    assert env._constraints_text() == 'click==7.0\n'
+    env.constraints = table.frozen(['base', 'docs'], exact=True)
+    assert env._constraints_text() == 'click==7.0\nsix==1.0.post1\n'
@@ -1,6 +1,8 @@
 """Tests for pip-compile-multi"""
 
 import os
+import itertools
+import threading
 try:
     from unittest import mock
 except ImportError:
@@ -10,8 +12,22 @@ import pytest
 
 from pipcompilemulti.environment import Environment
 from pipcompilemulti.dependency import Dependency
-from pipcompilemulti.options import OPTIONS, DEFAULT_HEADER
-from pipcompilemulti.actions import reference_cluster, merged_packages
+from pipcompilemulti.options import OPTIONS, DEFAULT_HEADER, Settings
+from pipcompilemulti.actions import (
+    reference_cluster,
+    merged_packages,
+    resolve_with_retries,
+    environments_pinning,
+    fingerprint_components,
+    skipped_environments,
+    recompile,
+)
+from pipcompilemulti.backends import BACKENDS
+from pipcompilemulti.files import write_atomically
+from pipcompilemulti.watch import watch
+from pipcompilemulti.journal import Journal
+from pipcompilemulti.config import locate_interpreters
+from pipcompilemulti.verify import generate_fingerprint_comment
 
 
 PIN = 'pycodestyle==2.3.1        # via flake8'
@@ -70,10 +86,12 @@ def test_parse_references(name, refs):
     assert result == refs
 
 
-def test_split_header():
-    """Check that default header is parsed from autogenerated base.txt"""
+def test_default_header():
+    """Check that default header is in autogenerated base.txt"""
     with open(os.path.join('requirements', 'base.txt')) as fp:
-        header, _ = Environment.split_header(fp)
+        header = list(itertools.takewhile(
+            lambda line: line.startswith('#'), fp,
+        ))
     expected = [
         line + '\n'
         for line in DEFAULT_HEADER.splitlines()
@@ -81,17 +99,6 @@ def test_split_header():
     assert header[1:] == expected
 
 
-def test_concatenation():
-    """Check lines are joined and extra spaces removed"""
-    lines = Environment.concatenated([
-        'abc  \\\n',
-        '   123  \\\n',
-        '?\n',
-        'MMM\n',
-    ])
-    assert list(lines) == ['abc 123 ?', 'MMM']
-
-
 def test_parse_hashes_with_comment():
     """Check that sample is parsed"""
     dep = Dependency(
@@ -252,3 +259,372 @@ def test_fix_pin_detects_version_conflict():
     assert ignored_pin is None
     with pytest.raises(RuntimeError):
         env.fix_pin('x==2')
+
+
+def test_resolve_retries_with_backoff():
+    """Check that failed resolution is retried with growing delay"""
+    env = mock.Mock(settings=Settings(retries=2, retry_delay=3),
+                    cancelled=False)
+    env.resolve.side_effect = [RuntimeError('a'), RuntimeError('b'), None]
+    with mock.patch('time.sleep') as sleep:
+        resolve_with_retries(env)
+    assert sleep.call_args_list == [mock.call(3), mock.call(6)]
+    env.resolve.side_effect = RuntimeError('c')
+    env.settings = Settings(retries=0)
+    with pytest.raises(RuntimeError):
+        resolve_with_retries(env)
+    env.resolve.side_effect = RuntimeError('d')
+    env.settings = Settings(retries=2)
+    env.cancelled = True
+    with pytest.raises(RuntimeError):
+        resolve_with_retries(env)
+    assert env.resolve.call_count == 5
+
+
+def test_fingerprint_depends_on_components():
+    """Check that fingerprint changes with options and references"""
+    infile = os.path.join('requirements', 'base.in')
+    first = generate_fingerprint_comment(infile, ['a', 'b'])
+    assert first.startswith('# Fingerprint:')
+    assert first == generate_fingerprint_comment(infile, ['a', 'b'])
+    assert first != generate_fingerprint_comment(infile, ['ab'])
+    assert first != generate_fingerprint_comment(infile, ['a', 'c'])
+
+
+def test_fingerprint_depends_on_target_interpreter():
+    """
+    Check that lockfiles of other interpreters are not up to date,
+    and that fingerprint doesn't depend on Python running the tool.
+    """
+    current = fingerprint_components(Environment('base', settings=Settings()),
+                                     DEFAULT_HEADER)
+    with mock.patch('pipcompilemulti.interpreters.interpreter_version',
+                    return_value=('2', '7')):
+        other = fingerprint_components(
+            Environment('base', settings=Settings(
+                python_executable='/usr/bin/python2.7',
+            )),
+            DEFAULT_HEADER,
+        )
+    assert other[:-1] == current
+    assert other[-1] == 'python=2.7'
+
+
+def test_read_packages_from_lockfile(tmpdir):
+    """Check that pins are parsed back from generated file"""
+    tmpdir.join('base.txt').write(
+        '# SHA1:123\n'
+        '-r other.txt\n'
+        'lib==1.0 \\\n'
+        '    --hash=sha256:abc\n'
+        'internal~=2.0             # via lib\n'
+    )
+    env = Environment('base')
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        env.read_packages()
+    assert env.packages == {'lib': '1.0', 'internal': '2.0'}
+
+
+def test_pin_command_without_rebuild():
+    """Check that --rebuild is passed only when requested"""
+    with mock.patch.dict(OPTIONS, {'upgrade': True}):
+        assert '--rebuild' in Environment('base').pin_command
+        command = Environment('base', rebuild=False).pin_command
+    assert '--rebuild' not in command
+    assert command[:4] == [
+        'pip-compile', '--no-header', '--verbose', '--upgrade',
+    ]
+
+
+@pytest.mark.parametrize('upgrade, rebuild', [(False, False), (True, True)])
+def test_auto_rebuild_only_when_upgrading(tmpdir, upgrade, rebuild):
+    """Check that environments with changed inputs keep pip-tools cache"""
+    settings = Settings(base_dir=str(tmpdir), rebuild='auto',
+                        upgrade=upgrade, incremental=True)
+    envs = {'base': Environment('base', settings=settings)}
+    skipped = skipped_environments(
+        envs, mock.Mock(), {'base': '# Fingerprint: new'}, None,
+        mock.Mock(), settings,
+    )
+    assert skipped == set()
+    assert envs['base'].rebuild is rebuild
+    assert ('--rebuild' in envs['base'].pin_command) is rebuild
+
+
+def test_pin_command_with_python_executable():
+    """Check that pip-compile runs under configured interpreter"""
+    options = {'upgrade': False, 'python_executable': '/usr/bin/python3.6'}
+    with mock.patch.dict(OPTIONS, options):
+        command = Environment('base').pin_command
+    assert command[:5] == [
+        '/usr/bin/python3.6', '-m', 'piptools', 'compile', '--no-header',
+    ]
+
+
+def test_locate_interpreters_for_matrix():
+    """Check that sections get interpreters of their python versions"""
+    sections = [
+        ('current', {}),
+        ('old', {'python': '2.6', 'include_names': ['py26']}),
+        ('missing', {'python': '1.5'}),
+    ]
+    found = {'2.6': '/usr/bin/python2.6'}
+    with mock.patch('pipcompilemulti.interpreters.find_interpreter',
+                    side_effect=found.get):
+        assert locate_interpreters(sections) == [
+            ('current', {}),
+            ('old', {'include_names': ['py26'],
+                     'python_executable': '/usr/bin/python2.6'}),
+        ]
+
+
+def test_write_lockfile_in_one_pass(tmpdir):
+    """Check that header, references and fixed pins are written"""
+    env = Environment('test', ignore={'base-lib': '1.0'})
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        tmpdir.join('.test.txt.resolved').write(
+            '# pip-compile header\n'
+            'base-lib==1.0\n'
+            'lib==2.0 \\\n'
+            '    --hash=sha256:abc\n'
+        )
+        env.write_lockfile('# header\n', ['base'])
+    assert tmpdir.join('test.txt').read() == (
+        '# header\n'
+        '-r base.txt\n'
+        'lib==2.0 \\\n'
+        '    --hash=sha256:abc\n'
+    )
+    assert not tmpdir.join('.test.txt.resolved').check()
+
+
+def test_write_lockfile_keeps_outfile_on_conflict(tmpdir):
+    """Check that outfile is not touched if conflict is detected"""
+    env = Environment('test', ignore={'lib': '1.0'})
+    tmpdir.join('test.txt').write('lib==1.0\n')
+    tmpdir.join('.test.txt.resolved').write('other==1.0\nlib==2.0\n')
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        with pytest.raises(RuntimeError):
+            env.write_lockfile('', [])
+    assert tmpdir.listdir() == [tmpdir.join('test.txt')]
+    assert tmpdir.join('test.txt').read() == 'lib==1.0\n'
+
+
+def test_failed_run_removes_resolved_files(tmpdir):
+    """Check that pip-compile output of failed and cancelled envs is removed"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\npytest\n')
+    test_resolved = threading.Event()
+
+    def compile_env(env):
+        """Fail for base after test is resolved"""
+        with open(env.resolved_file, 'w') as fp:
+            fp.write('six==1.0\n')
+        if env.name == 'test':
+            test_resolved.set()
+            return
+        test_resolved.wait(5)
+        raise RuntimeError("pip-compile failed")
+
+    backend = mock.Mock(compile=mock.Mock(side_effect=compile_env))
+    settings = Settings(base_dir=str(tmpdir), backend='mock', jobs=2)
+    with mock.patch.dict(BACKENDS, {'mock': lambda: backend}):
+        with pytest.raises(RuntimeError):
+            recompile(settings=settings)
+    assert test_resolved.is_set()
+    assert sorted(
+        path.basename for path in tmpdir.listdir()
+        if not path.basename.startswith('.pip-compile-multi')
+    ) == ['base.in', 'test.in']
+
+
+def test_write_atomically_keeps_unchanged_file(tmpdir):
+    """Check that file with the same content is not rewritten"""
+    path = str(tmpdir.join('base.txt'))
+    assert write_atomically(path, ['a\n', 'b\n'])
+    os.utime(path, (0, 0))
+    assert not write_atomically(path, ['a\n', 'b\n'])
+    assert os.stat(path).st_mtime == 0
+    assert write_atomically(path, ['a\n'])
+    assert tmpdir.listdir() == [tmpdir.join('base.txt')]
+
+
+def test_parse_text_joins_continued_lines():
+    """Check that whole file is parsed the same way as separate lines"""
+    parsed = list(Dependency.parse_text(
+        'lib==ver \\\n'
+        '    --hash=123 \\\n'
+        '    --hash=abc \\\n'
+        '    # comment\n'
+        '\n'
+        '-r base.txt\n'
+    ))
+    assert [dep.valid for dep in parsed] == [True, False, False]
+    assert [dep.line for dep in parsed[1:]] == ['', '-r base.txt']
+    dep = parsed[0]
+    assert dep.hashes.split() == ['--hash=123', '--hash=abc']
+    assert dep.comment == '# comment'
+    assert not hasattr(dep, '__dict__')
+    single = Dependency('lib==ver  --hash=123  --hash=abc  # comment')
+    assert (single.package, single.version, single.hashes.split()) == (
+        dep.package, dep.version, dep.hashes.split(),
+    )
+
+
+@pytest.mark.parametrize('text', [
+    '-e git+https://github.com/a/b.git@master#egg=b  # via c\n',
+    'a~=1.0 \\\n    # via b \\\n    # and c\n',
+    'six==1.0\r\n\n',
+    '-r base.txt\n--index-url http://a\\b\n',
+])
+def test_parse_text_matches_line_parsing(text):
+    """Check that tokenized text gives the same dependencies as lines"""
+    lines = Dependency.RE_CONTINUATION.sub(' ', text).split('\n')[:-1]
+    attrs = ('valid', 'is_vcs', 'package', 'version', 'comment')
+    parsed = [
+        tuple(getattr(dep, attr, None) for attr in attrs)
+        for dep in Dependency.parse_text(text)
+    ]
+    assert parsed == [
+        tuple(getattr(Dependency(line.strip()), attr, None) for attr in attrs)
+        for line in lines
+    ]
+
+
+def test_fix_pin_does_not_snapshot_options_per_line():
+    """Check that Settings aren't built from OPTIONS for every dependency"""
+    env = Environment('xxx')
+    with mock.patch.dict(OPTIONS, {'compatible_patterns': ['pycode*']}):
+        with mock.patch.object(Settings, 'from_options',
+                               side_effect=AssertionError):
+            assert env.fix_pin(PIN) == CMPT
+            assert [
+                dep.serialize() for dep in Dependency.parse_text(PIN)
+            ] == [CMPT]
+
+
+def test_watch_recompiles_modified_environments(tmpdir):
+    """Check that changed environments are passed to recompile"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\n')
+    calls = []
+
+    def sleep(_):
+        """Change test.in instead of sleeping"""
+        tmpdir.join('test.in').write('-r base.in\npytest\n')
+
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}), \
+            mock.patch('pipcompilemulti.watch.recompile',
+                       side_effect=lambda modified, **kwargs: calls.append(
+                           None if modified is None else set(modified))), \
+            mock.patch('time.sleep', side_effect=sleep):
+        watch(iterations=1)
+    assert calls == [None, {'test'}]
+
+
+def test_journal_completed_environments(tmpdir):
+    """
+    Check that only completed environments with same inputs
+    and unchanged lockfiles are resumed.
+    """
+    path = Journal.path(Settings(base_dir=str(tmpdir)))
+    base, test = str(tmpdir.join('base.txt')), str(tmpdir.join('test.txt'))
+    tmpdir.join('base.txt').write('six==1.0\n')
+    journal = Journal(path)
+    journal.record('base', 'fp1', Journal.COMPLETED, base)
+    journal.record('test', 'fp2', Journal.FAILED, test)
+    resumed = Journal(path)
+    resumed.load()
+    assert resumed.is_completed('base', 'fp1', base)
+    assert not resumed.is_completed('base', 'changed', base)
+    assert not resumed.is_completed('test', 'fp2', test)
+    tmpdir.join('base.txt').write('six==1.0\nclick==7.0\n')
+    assert not resumed.is_completed('base', 'fp1', base)
+    resumed.remove()
+    assert tmpdir.listdir() == [tmpdir.join('base.txt')]
+
+
+def test_journal_records_only_compiled_environments(tmpdir):
+    """Check that journal is not written for skipped environments"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\npytest\n')
+
+    def compile_env(env):
+        """Pin six"""
+        with open(env.resolved_file, 'w') as fp:
+            fp.write('six==1.0\n')
+
+    backend = mock.Mock(compile=mock.Mock(side_effect=compile_env))
+    settings = Settings(base_dir=str(tmpdir), backend='mock',
+                        incremental=True, upgrade=False)
+    with mock.patch.dict(BACKENDS, {'mock': lambda: backend}), \
+            mock.patch.object(Journal, 'record') as record:
+        recompile(settings=settings)
+        assert sorted(call[0][0] for call in record.call_args_list) == [
+            'base', 'test',
+        ]
+        tmpdir.join('test.in').write('-r base.in\nsix\n')
+        recompile(settings=settings)
+        assert record.call_args_list[-1][0][0] == 'test'
+        assert record.call_count == 3
+        recompile(settings=settings)
+        assert record.call_count == 3
+
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_fingerprint_written_only_in_incremental_mode(tmpdir, incremental):
+    """Check that lockfile format doesn't change without incremental mode"""
+    tmpdir.join('base.in').write('six\n')
+
+    def compile_env(env):
+        """Pin six"""
+        with open(env.resolved_file, 'w') as fp:
+            fp.write('six==1.0\n')
+
+    backend = mock.Mock(compile=mock.Mock(side_effect=compile_env))
+    settings = Settings(base_dir=str(tmpdir), backend='mock',
+                        incremental=incremental)
+    with mock.patch.dict(BACKENDS, {'mock': lambda: backend}):
+        recompile(settings=settings)
+    lockfile = tmpdir.join('base.txt').read()
+    assert ('# Fingerprint:' in lockfile) is incremental
+    assert lockfile.startswith('# SHA1:')
+
+
+def test_constraints_passed_to_pip_compile(tmpdir):
+    """Check that pins of references are written to temporary files"""
+    tmpdir.join('test.in').write('-r base.in\npytest\n')
+    written = {}
+
+    def compile_env(env):
+        """Save files passed to pip-compile"""
+        constrained = env.pin_command[-1]
+        written['constrained'] = open(constrained).read()
+        written['constraints'] = open(env.constraints_file).read()
+
+    backend = mock.Mock(compile=mock.Mock(side_effect=compile_env))
+    env = Environment('test', backend=backend,
+                      constraints={'six': '1.0', 'vcs-lib': ''})
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        env.run_pip_compile()
+    assert written == {
+        'constrained': '-r test.in\n-c .test.in.txt.constraints\n',
+        'constraints': 'six==1.0\n',
+    }
+    assert tmpdir.listdir() == [tmpdir.join('test.in')]
+
+
+def test_upgrade_package_in_pinning_environments(tmpdir):
+    """Check that only environments locking the package are upgraded"""
+    tmpdir.join('base.txt').write('Zope.Interface==4.0\nsix==1.0\n')
+    tmpdir.join('test.txt').write('-r base.txt\npytest==4.0\n')
+    options = {'base_dir': str(tmpdir), 'upgrade': False,
+               'upgrade_packages': ['zope-interface']}
+    with mock.patch.dict(OPTIONS, options):
+        envs = [Environment('base'), Environment('test'), Environment('new')]
+        assert environments_pinning(envs, ['zope-interface']) == {
+            'base', 'new',
+        }
+        assert envs[0].pin_command[3:5] == [
+            '--upgrade-package', 'zope-interface',
+        ]
@@ -0,0 +1,70 @@
+"""Tests for running sections of configuration"""
+
+import os
+import threading
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pipcompilemulti.options import OPTIONS
+from pipcompilemulti.discover import discover_environments
+from pipcompilemulti.planner import plan_sections, run_plan
+
+
+def test_run_plan_reuses_discovery_and_runs_directories_in_parallel(tmpdir):
+    """Check that sections in different directories run concurrently"""
+    for directory in ('one', 'two'):
+        tmpdir.mkdir(directory).join('base.in').write('six\n')
+    sections = [
+        ('first', {'base_dir': str(tmpdir.join('one'))}),
+        ('second', {'base_dir': str(tmpdir.join('two'))}),
+        ('included', {'base_dir': str(tmpdir.join('one')),
+                      'include_names': ['base']}),
+    ]
+    units = plan_sections(sections, dict(OPTIONS))
+    second_started = threading.Event()
+
+    def summary(env_confs, settings):
+        """Return directory and environments, waiting for second section"""
+        directory = os.path.basename(settings['base_dir'])
+        if directory == 'two':
+            second_started.set()
+        elif parallel:
+            assert second_started.wait(5)
+        return directory, [conf['name'] for conf in env_confs]
+
+    discover = 'pipcompilemulti.planner.discover_environments'
+    with mock.patch(discover, side_effect=discover_environments) as mocked:
+        parallel = False
+        results = run_plan(units, summary)
+        assert mocked.call_count == 2
+        second_started.clear()
+        parallel = True
+        parallel_results = run_plan(units, summary, parallel=True)
+    assert results == parallel_results == [
+        ('one', ['base']), ('two', ['base']), ('one', ['base']),
+    ]
+
+
+def test_sections_with_disjoint_outputs_run_in_parallel(tmpdir):
+    """Check that only sections sharing files in one directory are serialized"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\npytest\n')
+    tmpdir.join('docs.in').write('sphinx\n')
+    base_dir = str(tmpdir)
+    units = plan_sections([
+        ('py3', {'base_dir': base_dir, 'include_names': ['test']}),
+        ('py27', {'base_dir': base_dir, 'out_ext': 'txt27',
+                  'python_executable': '/usr/bin/python2.7'}),
+        ('docs', {'base_dir': base_dir, 'include_names': ['docs'],
+                  'python_executable': '/usr/bin/python3.7'}),
+        ('py36', {'base_dir': base_dir, 'include_names': ['test'],
+                  'python_executable': '/usr/bin/python3.6'}),
+    ], dict(OPTIONS))
+    assert [[name for _, name, _ in unit] for unit in units] == [
+        # py36 writes the same files as py3:
+        ['py3', 'py36'],
+        ['py27'],
+        ['docs'],
+    ]
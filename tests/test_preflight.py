@@ -0,0 +1,73 @@
+"""Tests for pre-flight conflicts detection"""
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pipcompilemulti.options import OPTIONS
+from pipcompilemulti.graph import EnvironmentGraph
+from pipcompilemulti.preflight import find_conflicts
+from pipcompilemulti.verify import generate_hash_comment
+
+
+def test_preflight_finds_conflicts_in_closure(tmpdir):
+    """Check that pins conflicting with merged constraints are found"""
+    tmpdir.join('base1.in').write('six==1.1  # comment\nclick\n')
+    tmpdir.join('base2.in').write('Six~=1.2\npytz; python_version < "3"\n')
+    tmpdir.join('together.in').write('-r base1.in\n-r base2.in\n')
+    tmpdir.join('other.in').write('pytz\n')
+    tmpdir.join('other.txt').write(
+        generate_hash_comment(str(tmpdir.join('other.in'))) +
+        'pytz==2019.1\n'
+    )
+    tmpdir.join('child.in').write('-r other.in\npytz<2019\n')
+    graph = EnvironmentGraph([
+        {'name': 'base1', 'refs': set()},
+        {'name': 'base2', 'refs': set()},
+        {'name': 'together', 'refs': {'base1', 'base2'}},
+        {'name': 'other', 'refs': set()},
+        {'name': 'child', 'refs': {'other'}},
+    ])
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        conflicts = find_conflicts(graph, ['together', 'child'])
+        assert [conflict[:2] for conflict in conflicts] == [('six', '1.1')]
+        conflicts = find_conflicts(graph, ['child'], use_lockfiles=True)
+        assert [conflict[:2] for conflict in conflicts] == [
+            ('pytz', '2019.1'),
+        ]
+
+
+def test_preflight_finds_disjoint_compatible_releases(tmpdir):
+    """Check that ~= constraints without common versions conflict"""
+    tmpdir.join('base.in').write('six~=1.2\nclick~=6.7.1\n')
+    tmpdir.join('test.in').write('-r base.in\nsix~=2.0\nclick~=6.7.0\n')
+    graph = EnvironmentGraph([
+        {'name': 'base', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+    ])
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        conflicts = find_conflicts(graph, ['base', 'test'])
+    assert conflicts == [(
+        'six', '~=1.2', str(tmpdir.join('base.in')),
+        'six~=2.0', str(tmpdir.join('test.in')),
+    )]
+
+
+def test_preflight_accepts_lockfile_without_post_release(tmpdir):
+    """Check that lockfile pin with dropped post-release doesn't conflict"""
+    tmpdir.join('base.in').write('six==1.2.post1\n')
+    tmpdir.join('base.txt').write(
+        generate_hash_comment(str(tmpdir.join('base.in'))) +
+        'six==1.2\n'
+    )
+    tmpdir.join('test.in').write('-r base.in\npytest\n')
+    graph = EnvironmentGraph([
+        {'name': 'base', 'refs': set()},
+        {'name': 'test', 'refs': {'base'}},
+    ])
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir)}):
+        assert len(find_conflicts(graph, ['test'], use_lockfiles=True)) == 1
+    with mock.patch.dict(OPTIONS, {'base_dir': str(tmpdir),
+                                   'forbid_post': {'base'}}):
+        assert find_conflicts(graph, ['test'], use_lockfiles=True) == []
@@ -0,0 +1,119 @@
+"""Tests for lockfiles verification"""
+
+import os
+import sys
+import subprocess
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import pytest
+
+from pipcompilemulti.options import OPTIONS, Settings
+from pipcompilemulti.discover import discover_environments
+from pipcompilemulti.verify import (
+    check_environments,
+    compare_hash_comments,
+    generate_hash_comment,
+    verify_environments,
+)
+
+
+def test_verify_cache_skips_unchanged_files(tmpdir):
+    """Check that verified files are not read again until they change"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('base.txt').write(generate_hash_comment(
+        str(tmpdir.join('base.in'))))
+    tmpdir.join('test.in').write('-r base.in\n')
+    tmpdir.join('test.txt').write('# SHA1:outdated\n')
+    options = {'base_dir': str(tmpdir), 'verify_cache': True}
+    with mock.patch.dict(OPTIONS, options), \
+            mock.patch('pipcompilemulti.verify.compare_hash_comments',
+                       side_effect=compare_hash_comments) as compare_mock:
+        assert not verify_environments()
+        assert compare_mock.call_count == 2
+        assert not verify_environments()
+        assert compare_mock.call_count == 3
+        tmpdir.join('test.txt').write(generate_hash_comment(
+            str(tmpdir.join('test.in'))))
+        assert verify_environments()
+        assert compare_mock.call_count == 4
+        assert verify_environments()
+        assert compare_mock.call_count == 4
+
+
+def test_verify_cache_reuses_discovered_references(tmpdir):
+    """Check that unchanged input files are not parsed for references"""
+    tmpdir.join('base.in').write('six\n')
+    tmpdir.join('test.in').write('-r base.in\n')
+    for name in ('base', 'test'):
+        tmpdir.join(name + '.txt').write(generate_hash_comment(
+            str(tmpdir.join(name + '.in'))))
+    settings = Settings(base_dir=str(tmpdir), verify_cache=True)
+    assert verify_environments(settings=settings)
+    with mock.patch('pipcompilemulti.environment.Environment.'
+                    'parse_reference_names') as parse_mock:
+        results = check_environments(settings=settings)
+    assert [result.name for result in results] == ['base', 'test']
+    assert not parse_mock.called
+
+
+def test_verify_cache_keeps_entries_of_other_environments(tmpdir):
+    """Check that partial runs don't forget verified environments"""
+    for name in ('base', 'test'):
+        tmpdir.join(name + '.in').write('six\n')
+        tmpdir.join(name + '.txt').write(generate_hash_comment(
+            str(tmpdir.join(name + '.in'))))
+    settings = Settings(base_dir=str(tmpdir), verify_cache=True)
+    env_confs = discover_environments(settings)
+    edited = []
+
+    def compare_and_edit(env):
+        """Edit input file while it's being verified for the first time"""
+        result = compare_hash_comments(env)
+        if env.name == 'test' and not edited:
+            tmpdir.join('test.in').write('six\npytest\n')
+            edited.append(env.name)
+        return result
+
+    with mock.patch('pipcompilemulti.verify.compare_hash_comments',
+                    side_effect=compare_and_edit) as compare_mock:
+        for name in ('base', 'test'):
+            results = check_environments(
+                [conf for conf in env_confs if conf['name'] == name],
+                settings,
+            )
+            assert [result.ok for result in results] == [True]
+        results = check_environments(env_confs, settings)
+        assert [result.ok for result in results] == [True, False]
+        assert compare_mock.call_count == 3
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='requires -X importtime')
+def test_verify_imports_only_what_it_needs(tmpdir):
+    """Check that verify command doesn't import recompile machinery"""
+    tmpdir.mkdir('requirements')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c',
+         'from pipcompilemulti.cli_v1 import cli; cli(["verify"])'],
+        cwd=str(tmpdir), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    _, stderr = process.communicate()
+    assert process.returncode == 0
+    imported = set(
+        line.rsplit('|', 1)[-1].strip()
+        for line in stderr.decode('utf-8').splitlines()
+        if line.startswith('import time:')
+    )
+    assert 'pipcompilemulti.verify' in imported
+    assert imported.isdisjoint([
+        'pipcompilemulti.actions',
+        'pipcompilemulti.backends',
+        'pipcompilemulti.executor',
+        'multiprocessing.pool',
+        'subprocess',
+    ])